@@ -0,0 +1,218 @@
+# Filters the adc's movement readings before they move a paddle.
+# Each channel goes through calibration to -1..1, outlier rejection, one-euro smoothing, a short linear prediction to make up for the sampling delay, then a deadband around the centre.
+# Nothing here touches the hardware, so traces recorded on the Pi can be run through the filter on any machine, e.g.
+#   python adc_filter.py adc_trace.csv --channel player1 --output filtered.csv
+# Traces are recorded by hardware_input.py when config.adc_trace_file is set. Each line is "time,player1,player2", with an empty value for a failed read.
+# adc_trace_sample.csv is a short trace with the control held still, moved, glitching and failing to read. After changing the filter, check it still behaves with
+#   python adc_filter.py adc_trace_sample.csv --check
+import argparse
+import csv
+import math
+import sys
+import config
+
+def smoothing_factor(cutoff, dt):
+    """
+    Returns the weight an exponential moving average with the given cutoff frequency in Hz gives to a new sample, when samples are dt seconds apart.
+    """
+    tau = 1.0 / (2 * math.pi * cutoff)
+    return 1.0 / (1.0 + tau / dt)
+
+def apply_deadband(x, deadband):
+    """
+    Returns 0 for positions inside the deadband around the centre. What's left is scaled so the output still reaches 1 at the ends, and doesn't jump at the edge of the deadband.
+    """
+    if abs(x) <= deadband:
+        return 0.0
+    return math.copysign((abs(x) - deadband) / (1.0 - deadband), x)
+
+class ChannelFilter:
+    """
+    Filters one adc channel. add is called with every timestamped sample, and value gives the filtered position at a given time, between -1 and 1.
+
+    A sample which jumps further than outlier_threshold from the filtered position is held back. If the next sample agrees with it the control really did move that far and both are used, otherwise it's thrown away.
+    Failed reads are given as None and skipped, so a glitch leaves the paddle where it was rather than snapping it to the centre.
+
+    Smoothing uses the one-euro filter: an exponential moving average whose cutoff frequency rises with the speed of the control.
+    The position stays steady while the control is still, but doesn't lag far behind when it moves quickly.
+    The smoothed speed is also used to predict the position prediction_time past the last sample, to hide some of the delay from sampling and smoothing.
+    """
+    def __init__(self, min_val, max_val, min_cutoff=None, beta=None, outlier_threshold=None, prediction_time=None, deadband=None, derivative_cutoff=1.0, stale_time=0.1):
+        self.min_val = min_val
+        self.max_val = max_val
+        self.min_cutoff = config.adc_filter_min_cutoff if min_cutoff == None else min_cutoff
+        self.beta = config.adc_filter_beta if beta == None else beta
+        self.outlier_threshold = config.adc_filter_outlier_threshold if outlier_threshold == None else outlier_threshold
+        self.prediction_time = config.adc_filter_prediction_time if prediction_time == None else prediction_time
+        self.deadband = config.adc_filter_deadband if deadband == None else deadband
+        self.derivative_cutoff = derivative_cutoff
+        self.stale_time = stale_time # no prediction is made from a sample older than this, e.g. while reads are failing
+
+        self.position = None # the smoothed position, or None before the first sample
+        self.velocity = 0.0 # the smoothed speed of the position, per second
+        self.time = None # when the last sample used was taken
+        self.held_outlier = None # (time, position) of a sample which jumped too far, waiting for the next sample to confirm it
+
+        self.samples = 0
+        self.failed_reads = 0
+        self.outliers_rejected = 0
+
+    def calibrate(self, raw):
+        """
+        Maps a raw reading onto -1..1 using the channel's min and max values.
+        """
+        normalized = ((raw - self.min_val) / float(self.max_val - self.min_val) - 0.5) * 2.0
+        return max(-1.0, min(1.0, normalized))
+
+    def add(self, time, raw):
+        """
+        Adds a raw reading taken at the given time, in seconds. raw is None if the read failed.
+        """
+        self.samples += 1
+        if raw == None:
+            self.failed_reads += 1
+            return
+
+        x = self.calibrate(raw)
+        if self.position == None:
+            self.position = x
+            self.time = time
+            return
+
+        held = self.held_outlier
+        if abs(x - self.position) > self.outlier_threshold:
+            if held == None or abs(x - held[1]) > self.outlier_threshold:
+                # Either a lone jump, or one which doesn't agree with the last, so hold this one back and wait for the next
+                if held != None:
+                    self.outliers_rejected += 1
+                self.held_outlier = (time, x)
+                return
+            self.smooth(held[0], held[1])
+        elif held != None:
+            self.outliers_rejected += 1
+        self.held_outlier = None
+        self.smooth(time, x)
+
+    def smooth(self, time, x):
+        dt = time - self.time
+        if dt <= 0:
+            return
+        self.velocity += smoothing_factor(self.derivative_cutoff, dt) * ((x - self.position) / dt - self.velocity)
+        cutoff = self.min_cutoff + self.beta * abs(self.velocity)
+        self.position += smoothing_factor(cutoff, dt) * (x - self.position)
+        self.time = time
+
+    def value(self, now):
+        """
+        Returns the filtered position at time now, between -1 and 1. Positions inside the deadband around the centre are 0.
+        """
+        if self.position == None:
+            return 0.0
+
+        age = now - self.time
+        x = self.position
+        if age < self.stale_time:
+            x += self.velocity * (max(0.0, age) + self.prediction_time)
+        x = max(-1.0, min(1.0, x))
+        return apply_deadband(x, self.deadband)
+
+def read_trace(filename):
+    """
+    Returns the samples in a trace recorded by hardware_input.py, as a list of dicts like {"time": t, "player1": value, "player2": value}.
+    Failed reads are None.
+    """
+    samples = []
+    with open(filename) as f:
+        for row in csv.DictReader(f):
+            samples.append(dict((name, float(value) if value != "" else None) for name, value in row.items()))
+    return samples
+
+def run_trace(samples, channel, channel_filter):
+    """
+    Runs one channel of a trace through a filter. Returns a list of (time, raw value, filtered value), with the filtered value taken as each sample arrives.
+    """
+    results = []
+    for sample in samples:
+        channel_filter.add(sample["time"], sample[channel])
+        results.append((sample["time"], sample[channel], channel_filter.value(sample["time"])))
+    return results
+
+def check_trace(results, channel_filter, settle_time=0.3, spike_size=0.5):
+    """
+    Checks the filter did its job on one channel of a trace, given the results of run_trace. Returns a list of problems, which is empty if there were none.
+      - a lone reading which jumps further than spike_size and straight back barely moves the output
+      - a failed read leaves the output where it was
+      - once the control has been still for settle_time, the output has caught up with it, and is 0 if it's inside the deadband
+    """
+    problems = []
+    positions = [None if raw == None else channel_filter.calibrate(raw) for time, raw, filtered in results]
+    outliers = set()
+    for i in range(1, len(results) - 1):
+        before, x, after = positions[i - 1:i + 2]
+        if None not in (before, x, after) and abs(x - before) > spike_size and abs(x - after) > spike_size:
+            outliers.add(i)
+
+    for i in range(1, len(results)):
+        time, raw, filtered = results[i]
+        change = abs(filtered - results[i - 1][2])
+
+        if positions[i] == None:
+            if change > 0.05:
+                problems.append("{0:.3f}: the output moved {1:.3f} on a failed read".format(time, change))
+            continue
+
+        if i in outliers:
+            moved = max(change, abs(results[i + 1][2] - results[i - 1][2]))
+            if moved > 0.1:
+                problems.append("{0:.3f}: the output moved {1:.3f} on a lone outlier".format(time, moved))
+            continue
+
+        # The readings over the last settle_time, leaving out failed reads and lone outliers
+        if results[0][0] > time - settle_time:
+            continue
+        recent = [positions[j] for j in range(i + 1) if results[j][0] > time - settle_time and positions[j] != None and j not in outliers]
+        if max(recent) - min(recent) <= 0.05:
+            expected = apply_deadband(sum(recent) / len(recent), channel_filter.deadband)
+            if abs(filtered - expected) > 0.1 or (expected == 0.0 and filtered != 0.0):
+                problems.append("{0:.3f}: the output is {1:.3f} after the control was held at {2:.3f}".format(time, filtered, expected))
+    return problems
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run an adc trace recorded on the Pi through the movement filter.")
+    parser.add_argument("trace", help="the trace file, as recorded with config.adc_trace_file")
+    parser.add_argument("--channel", choices=["player1", "player2"], default="player1")
+    parser.add_argument("--ldr", action="store_true", help="calibrate for an LDR controller, using config.adc_ldr_min_val and adc_ldr_max_val")
+    parser.add_argument("--output", help="write time, raw and filtered values to this CSV file")
+    parser.add_argument("--check", action="store_true", help="check the filter's behaviour on both channels of the trace, and exit with an error if it's wrong")
+    args = parser.parse_args()
+
+    if args.check:
+        samples = read_trace(args.trace)
+        failed = False
+        for channel in ["player1", "player2"]:
+            channel_filter = ChannelFilter(config.adc_min_val, config.adc_max_val)
+            problems = check_trace(run_trace(samples, channel, channel_filter), channel_filter)
+            for problem in problems:
+                print("{0} {1}".format(channel, problem))
+            failed = failed or len(problems) > 0
+        print("FAILED" if failed else "OK")
+        sys.exit(1 if failed else 0)
+
+    if args.ldr:
+        channel_filter = ChannelFilter(config.adc_ldr_min_val, config.adc_ldr_max_val)
+    else:
+        channel_filter = ChannelFilter(config.adc_min_val, config.adc_max_val)
+    results = run_trace(read_trace(args.trace), args.channel, channel_filter)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            writer = csv.writer(f)
+            writer.writerow(["time", "raw", "filtered"])
+            writer.writerows(results)
+
+    # How much the output moves from one sample to the next. When the control is held still this is the jitter which reaches the paddle.
+    steps = [abs(b[2] - a[2]) for a, b in zip(results, results[1:])]
+    print("samples: {0}, failed reads: {1}, outliers rejected: {2}".format(channel_filter.samples, channel_filter.failed_reads, channel_filter.outliers_rejected))
+    if steps:
+        print("change between samples: mean {0:.4f}, max {1:.4f}".format(sum(steps) / len(steps), max(steps)))
+        print("samples with no change: {0:.1%}".format(sum(1 for step in steps if step == 0.0) / float(len(steps))))
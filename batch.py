@@ -0,0 +1,140 @@
+# Plays thousands of seeded headless matches across a pool of worker processes and aggregates the results.
+# Match i is always played with seed + i, and only integer counts are summed, so the results are identical whatever the number of workers.
+# config.py settings can be swept over a grid, e.g.
+#   python batch.py -n 1000 --sweep ball_init_speed=0.4,0.5,0.6 --sweep paddle_height=3,4
+import argparse
+import itertools
+import json
+import logging
+import multiprocessing
+import random
+import time
+import config
+import game
+import simulate
+
+def play_match(task):
+    """
+    Plays a single headless match. This is run in the worker processes.
+    task is a tuple (settings, seed) where settings is a dict of config.py values to use.
+    Returns a dict of statistics about the match.
+    """
+    settings, seed, max_steps = task
+    for name, value in settings.items():
+        setattr(config, name, value)
+
+    # The players and the game get separate random number generators so that the players' choices don't change the game's random numbers
+    random.seed(seed * 2 + 1)
+    g = game.Game(None, input_sources=[simulate.track_ball, simulate.track_ball], seed=seed * 2)
+    winner = g.play_headless(max_steps)
+
+    result = dict(g.stats)
+    result["winner"] = winner
+    return result
+
+def empty_totals():
+    return {
+            "matches": 0,
+            "player1_wins": 0,
+            "player2_wins": 0,
+            "unfinished": 0,
+            "points": 0,
+            "paddle_bounces": 0,
+            "wall_bounces": 0,
+            "longest_rally": 0,
+            "steps": 0
+            }
+
+def add_result(totals, result):
+    totals["matches"] += 1
+    if result["winner"] == "player1":
+        totals["player1_wins"] += 1
+    elif result["winner"] == "player2":
+        totals["player2_wins"] += 1
+    else:
+        totals["unfinished"] += 1
+
+    for key in ["points", "paddle_bounces", "wall_bounces", "steps"]:
+        totals[key] += result[key]
+    totals["longest_rally"] = max(totals["longest_rally"], result["longest_rally"])
+
+def summarize(totals):
+    """
+    Adds win rates and averages to the integer totals.
+    """
+    summary = dict(totals)
+    matches = float(max(totals["matches"], 1))
+    points = float(max(totals["points"], 1))
+    summary["player1_win_rate"] = totals["player1_wins"] / matches
+    summary["player2_win_rate"] = totals["player2_wins"] / matches
+    summary["points_per_match"] = totals["points"] / matches
+    summary["mean_rally_length"] = totals["paddle_bounces"] / points
+    summary["wall_bounces_per_point"] = totals["wall_bounces"] / points
+    return summary
+
+def settings_grid(sweeps):
+    """
+    Turns a dict of {setting name: list of values} into a list of settings dicts, one for each point in the grid.
+    """
+    names = sorted(sweeps.keys())
+    return [dict(zip(names, values)) for values in itertools.product(*[sweeps[name] for name in names])]
+
+def run_batch(matches, sweeps=None, seed=0, workers=None, max_steps=100000):
+    """
+    Plays the given number of matches at every point in the settings grid, spread across a pool of worker processes.
+    Returns a list of (settings, summary) tuples in grid order.
+    """
+    grid = settings_grid(sweeps or {})
+    tasks = [(settings, seed + i, max_steps) for settings in grid for i in range(matches)]
+
+    pool = multiprocessing.Pool(processes=workers)
+    try:
+        # imap returns results in task order, so they are always added up in the same order
+        results = pool.imap(play_match, tasks, chunksize=max(1, len(tasks) // (4 * (workers or multiprocessing.cpu_count()))))
+        totals = [empty_totals() for settings in grid]
+        for i, result in enumerate(results):
+            add_result(totals[i // matches], result)
+    finally:
+        pool.close()
+        pool.join()
+
+    return [(settings, summarize(t)) for settings, t in zip(grid, totals)]
+
+def parse_sweep(text):
+    """
+    Parses a sweep argument like "paddle_height=3,4,5" into ("paddle_height", [3, 4, 5]).
+    The values are converted to the same type as the current config.py value.
+    """
+    name, _, values = text.partition("=")
+    if not hasattr(config, name) or values == "":
+        raise argparse.ArgumentTypeError("expected <config setting>=<value>,<value>,... but got {0}".format(text))
+    setting_type = type(getattr(config, name))
+    return name, [setting_type(value) for value in values.split(",")]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Play seeded headless matches across a process pool and aggregate the results.")
+    parser.add_argument("-n", "--matches", type=int, default=1000, help="number of matches at each point of the settings grid")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="number of worker processes (default: one per core)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first match")
+    parser.add_argument("--max-steps", type=int, default=100000, help="give up on a match after this many simulation steps")
+    parser.add_argument("--sweep", type=parse_sweep, action="append", default=[], help="a config.py setting and the values to try, e.g. paddle_height=3,4,5")
+    parser.add_argument("--json", help="also save the results to this file as JSON")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    start_time = time.time()
+    results = run_batch(args.matches, dict(args.sweep), args.seed, args.workers, args.max_steps)
+    elapsed = time.time() - start_time
+
+    for settings, summary in results:
+        print(", ".join("{0}={1}".format(name, value) for name, value in sorted(settings.items())) or "default settings")
+        print("  matches: {matches}, player1 win rate: {player1_win_rate:.3f}, player2 win rate: {player2_win_rate:.3f}, unfinished: {unfinished}".format(**summary))
+        print("  points per match: {points_per_match:.2f}, mean rally length: {mean_rally_length:.2f}, longest rally: {longest_rally}, wall bounces per point: {wall_bounces_per_point:.2f}".format(**summary))
+
+    total_matches = sum(summary["matches"] for settings, summary in results)
+    print("Played {0} matches in {1:.2f}s ({2:.1f} matches per second)".format(total_matches, elapsed, total_matches / elapsed))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump([{"settings": settings, "results": summary} for settings, summary in results], f, indent=4, sort_keys=True)
@@ -0,0 +1,360 @@
+# Steps the physics of many independent games at once using NumPy arrays.
+# It follows the same rules as Game.handle_input with input sources followed by Game.update, but for N games in one vectorized step.
+# This is meant for bulk experiments, e.g.
+#   python batch_physics.py -n 100000 --steps 1000
+# and python batch_physics.py --verify checks it against the scalar Game.
+import argparse
+import logging
+import time
+import numpy as np
+import collision
+import config
+
+# Values of the state array. These match the strings used for Game.game_state.
+SERVING = 0
+PLAYING = 1
+ROUND_ENDING = 2
+
+# Index of each player in the paddle arrays, and the values of the serving array
+PLAYER1 = 0
+PLAYER2 = 1
+
+# What the ball hits first in BatchPhysics.move_ball. PLAYER1 and PLAYER2 mean the ball hit that player's paddle.
+HIT_NOTHING = -1
+HIT_WALL = 2
+
+class BatchPhysics:
+    """
+    Holds the ball and paddle state of n independent games in NumPy arrays.
+    Paddle arrays have the shape (2, n), where the first index is PLAYER1 or PLAYER2.
+    """
+    def __init__(self, n, seed=None):
+        self.n = n
+        self.rng = np.random.RandomState(seed)
+
+        self.width = config.game_width
+        self.height = config.game_height
+        self.init_speed = config.ball_init_speed
+        self.sim_step_time = 1 / float(config.game_sim_rate)
+
+        self.ball_x = np.zeros(n)
+        self.ball_y = np.zeros(n)
+        self.ball_vx = np.zeros(n)
+        self.ball_vy = np.zeros(n)
+        self.ball_prev_x = np.zeros(n)
+        self.ball_prev_y = np.zeros(n)
+
+        # The paddles' x positions never change
+        self.paddle_x = np.array([config.paddle_offset, config.game_width - 1 - config.paddle_offset], dtype=float)
+        self.paddle_y = np.zeros((2, n))
+        self.paddle_vy = np.zeros((2, n))
+        self.paddle_height = np.zeros((2, n))
+        self.is_stretched = np.zeros((2, n), dtype=bool)
+        self.stretch_time_left = np.zeros((2, n))
+        self.stretches_left = np.full((2, n), config.paddle_max_stretches, dtype=np.int32)
+        self.score = np.ones((2, n), dtype=np.int32) # scores start at 1, like Paddle.score
+
+        self.state = np.full(n, SERVING, dtype=np.int8)
+        self.serving = np.full(n, PLAYER1, dtype=np.int8)
+
+        self.reset_rounds()
+
+    def reset_rounds(self, mask=None):
+        """
+        Resets the ball and paddles of the games in mask (all games if mask is None), like Game.reset_round.
+        """
+        if mask is None:
+            mask = np.ones(self.n, dtype=bool)
+        count = np.count_nonzero(mask)
+
+        self.ball_x[mask] = self.width / 2.0
+        self.ball_y[mask] = self.height / 2.0
+        self.ball_vx[mask] = self.rng.choice([-1.0, 1.0], size=count) * self.init_speed
+        self.ball_vy[mask] = 0.0
+        self.ball_prev_x[mask] = np.nan
+        self.ball_prev_y[mask] = np.nan
+
+        for p in [PLAYER1, PLAYER2]:
+            self.paddle_height[p, mask] = config.paddle_height
+            self.paddle_y[p, mask] = self.height / 2.0 - np.floor(config.paddle_height / 2.0)
+            self.paddle_vy[p, mask] = 0.0
+            self.is_stretched[p, mask] = False
+
+        self.state[mask] = SERVING
+
+    def apply_input(self, vy, serve=None, stretch=None):
+        """
+        Applies the players' input to every game, like Game.apply_player_input.
+        vy is an array of paddle velocities with shape (2, n). serve and stretch are optional boolean arrays with the same shape.
+        """
+        for p in [PLAYER1, PLAYER2]:
+            self.paddle_vy[p] = vy[p]
+
+            # Note the state is checked again for each player, since player1 serving changes it before player2's input is applied
+            # A player's own serve doesn't let them stretch on the same step, as Game.apply_player_input only stretches if the game was already playing
+            was_playing = self.state == PLAYING
+            if serve is not None:
+                serving = (self.state == SERVING) & serve[p] & (self.serving == p)
+                self.state[serving] = PLAYING
+                self.ball_vx[serving] = self.init_speed if p == PLAYER1 else -self.init_speed
+                # Game.serve_ball always hands the serve to player2
+                self.serving[serving] = PLAYER2
+
+            if stretch is not None:
+                stretching = was_playing & stretch[p] & (self.stretches_left[p] > 0)
+                self.is_stretched[p, stretching] = True
+                self.stretch_time_left[p, stretching] = config.paddle_stretch_duration
+                self.stretches_left[p, stretching] -= 1
+                self.paddle_height[p, stretching] += 2
+                self.paddle_y[p, stretching] -= 1
+
+    def update(self, bounce_random=None):
+        """
+        Advances every game by one simulation step, like Game.update.
+        bounce_random is an optional array of n numbers in [0, 1) used for the bounce speed of any game whose ball hits a paddle, in place of random.random().
+        Returns a tuple of boolean arrays (player1_scored, player2_scored).
+        """
+        # Move the ball and paddles
+        self.ball_prev_x[:] = self.ball_x
+        self.ball_prev_y[:] = self.ball_y
+        self.ball_x += self.ball_vx
+        self.ball_y += self.ball_vy
+
+        self.paddle_y += self.paddle_vy
+        self.paddle_vy[:] = 0.0
+        self.stretch_time_left[self.is_stretched] -= self.sim_step_time
+        unstretching = self.is_stretched & (self.stretch_time_left <= 0)
+        self.is_stretched[unstretching] = False
+        self.paddle_height[unstretching] = config.paddle_height
+        self.paddle_y[unstretching] += 1
+
+        # Prevent the paddles moving off screen
+        y_min = 0
+        y_max = self.height
+        self.paddle_y = np.where(self.paddle_y < y_min, y_min,
+                np.where(self.paddle_y + self.paddle_height >= y_max, y_max - self.paddle_height, self.paddle_y))
+
+        # Games which are serving keep the ball in front of the serving player's paddle
+        serving = self.state == SERVING
+        self.ball_vx[serving] = 0.0
+        self.ball_vy[serving] = 0.0
+        self.ball_prev_x[serving] = self.ball_x[serving]
+        self.ball_prev_y[serving] = self.ball_y[serving]
+        for p, offset in [(PLAYER1, 1), (PLAYER2, -1)]:
+            mask = serving & (self.serving == p)
+            self.ball_x[mask] = self.paddle_x[p] + offset
+            self.ball_y[mask] = self.paddle_y[p, mask] + 1
+
+        # Everything else is for games in play
+        playing = ~serving
+
+        # Move the ball along its path, bouncing off any walls and paddles it hits on the way
+        if bounce_random is None:
+            bounce_random = self.rng.random_sample(self.n)
+        self.move_ball(playing, y_min, y_max, bounce_random)
+
+        # Scoring
+        player2_scored = playing & (self.ball_x < 0)
+        player1_scored = playing & ~player2_scored & (self.ball_x > self.width - 1)
+        self.score[PLAYER1, player1_scored] += 1
+        self.score[PLAYER2, player2_scored] += 1
+        self.state[player1_scored | player2_scored] = ROUND_ENDING
+
+        return player1_scored, player2_scored
+
+    def move_ball(self, playing, y_min, y_max, bounce_random):
+        """
+        Works out the ball's path for this step in every game that is playing, using swept collision detection like Game.move_ball.
+        Each time round the loop, every ball still moving either reaches the end of its path or bounces off whatever it hits first.
+        """
+        x = self.ball_prev_x.copy()
+        y = self.ball_prev_y.copy()
+        vx = self.ball_vx
+        vy = self.ball_vy
+        time_left = np.ones(self.n)
+        moving = playing.copy()
+        r = config.ball_bounce_randomness
+
+        # Divisions by a zero velocity are expected below, and the results are never used
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for i in range(collision.max_bounces_per_step):
+                # Find whichever the ball hits first, if anything. Times of inf mean no hit.
+                hit_time = np.where(vy < 0, (y_min - y) / vy, np.where(vy > 0, (y_max - y) / vy, np.inf))
+                hit_time = np.where(hit_time > time_left, np.inf, np.maximum(hit_time, 0.0))
+                hit = np.where(np.isfinite(hit_time), HIT_WALL, HIT_NOTHING)
+
+                for p in [PLAYER1, PLAYER2]:
+                    t = self.paddle_hit_time(p, x, y, time_left)
+                    closer = t < hit_time
+                    hit_time = np.where(closer, t, hit_time)
+                    hit[closer] = p
+
+                missed = moving & (hit == HIT_NOTHING)
+                x[missed] += vx[missed] * time_left[missed]
+                y[missed] += vy[missed] * time_left[missed]
+                moving &= ~missed
+
+                # Move the balls to where they hit and bounce them
+                x[moving] += vx[moving] * hit_time[moving]
+                y[moving] += vy[moving] * hit_time[moving]
+                time_left[moving] -= hit_time[moving]
+
+                walls = moving & (hit == HIT_WALL)
+                y[walls] = np.where(vy[walls] < 0, y_min, y_max)
+                vy[walls] *= -1
+
+                for p in [PLAYER1, PLAYER2]:
+                    hits = moving & (hit == p)
+                    height = self.paddle_height[p, hits]
+                    new_vx = (1.0 - r + bounce_random[hits] * 2 * r) * self.init_speed
+                    y_delta = (y[hits] + 0.5) - (self.paddle_y[p, hits] + height / 2.0)
+                    vx[hits] = new_vx if p == PLAYER1 else -new_vx
+                    vy[hits] = (2 * y_delta * self.init_speed) / height
+
+                if not moving.any():
+                    break
+
+        self.ball_x[playing] = x[playing]
+        self.ball_y[playing] = y[playing]
+
+    def paddle_hit_time(self, p, x, y, t_max):
+        """
+        Returns the earliest time in [0, t_max] that each ball is inside the hitbox of paddle p, or inf if it isn't, like collision.box_time.
+        Balls moving away from the paddle never hit it.
+        """
+        left_x, right_x, top_y, bottom_y = self.hitbox(p)
+        vx = self.ball_vx
+        vy = self.ball_vy
+
+        t_enter = np.zeros(self.n)
+        t_exit = t_max.copy()
+        valid = (vx < 0) if p == PLAYER1 else (vx > 0)
+        for start, velocity, low, high in [(x, vx, left_x, right_x), (y, vy, top_y, bottom_y)]:
+            still = velocity == 0
+            valid &= ~(still & ((start < low) | (start > high)))
+            t_low = (low - start) / velocity
+            t_high = (high - start) / velocity
+            t_enter = np.where(still, t_enter, np.maximum(t_enter, np.minimum(t_low, t_high)))
+            t_exit = np.where(still, t_exit, np.minimum(t_exit, np.maximum(t_low, t_high)))
+
+        valid &= t_enter <= t_exit
+        return np.where(valid, t_enter, np.inf)
+
+    def hitbox(self, p):
+        """
+        Returns (left_x, right_x, top_y, bottom_y) of paddle p's hitbox in every game, like Paddle.hitbox.
+        """
+        top_y = np.floor(self.paddle_y[p])
+        bottom_y = top_y + self.paddle_height[p]
+        if p == PLAYER1:
+            return self.paddle_x[p], self.paddle_x[p] + 2, top_y, bottom_y
+        else:
+            return self.paddle_x[p] - 1, self.paddle_x[p] + 1, top_y, bottom_y
+
+    def track_ball(self):
+        """
+        Returns paddle velocities for every game from players which move towards the ball at half speed with some random error.
+        This is the vectorized version of simulate.track_ball.
+        """
+        speed = config.paddle_speed / 2.0
+        error = self.rng.uniform(-1.0, 1.0, size=(2, self.n))
+        distance = (self.ball_y + error) - (self.paddle_y + self.paddle_height / 2.0)
+        return np.clip(distance, -speed, speed)
+
+def run(n, steps, seed=None):
+    """
+    Plays n games for the given number of steps between ball tracking players, resetting rounds as points are scored.
+    Returns (physics, seconds taken).
+    """
+    physics = BatchPhysics(n, seed)
+    serve = np.ones((2, n), dtype=bool)
+    start_time = time.time()
+    for i in range(steps):
+        physics.apply_input(physics.track_ball(), serve=serve)
+        physics.update()
+        physics.reset_rounds(physics.state == ROUND_ENDING)
+    return physics, time.time() - start_time
+
+def verify(n=20, steps=2000, seed=0):
+    """
+    Steps n scalar Games and a BatchPhysics side by side with the same random inputs, and returns the largest difference in any ball or paddle position.
+    The bounce speeds are given to both from the same random numbers.
+    Every tenth step both players press serve and stretch together, so a serve and a stretch on the same step are always checked.
+    """
+    import game
+
+    class FixedRandom:
+        # Stands in for a Game's random number generator, returning the numbers given to the batch
+        def __init__(self):
+            self.value = 0.0
+        def random(self):
+            return self.value
+        def choice(self, seq):
+            return seq[0]
+
+    rng = np.random.RandomState(seed)
+    physics = BatchPhysics(n, seed)
+    games = []
+    for i in range(n):
+        g = game.Game(None)
+        g.ball.rng = FixedRandom()
+        g.reset_round()
+        games.append(g)
+
+    largest_difference = 0.0
+    for step in range(steps):
+        vy = rng.uniform(-config.paddle_speed, config.paddle_speed, size=(2, n))
+        serve = rng.random_sample((2, n)) < 0.1
+        stretch = rng.random_sample((2, n)) < 0.001
+        if step % 10 == 0:
+            serve[:] = True
+            stretch[:] = True
+        bounce_random = rng.random_sample(n)
+
+        physics.apply_input(vy, serve, stretch)
+        physics.update(bounce_random)
+
+        for i, g in enumerate(games):
+            g.ball.rng.value = bounce_random[i]
+            for p, paddle in enumerate([g.paddle1, g.paddle2]):
+                g.apply_player_input(paddle, {"vy": vy[p, i], "serve": serve[p, i], "stretch": stretch[p, i]})
+            g.update()
+
+            differences = [g.ball.x - physics.ball_x[i], g.ball.y - physics.ball_y[i],
+                    g.ball.vx - physics.ball_vx[i], g.ball.vy - physics.ball_vy[i],
+                    g.paddle1.y - physics.paddle_y[PLAYER1, i], g.paddle2.y - physics.paddle_y[PLAYER2, i]]
+            largest_difference = max(largest_difference, max(abs(d) for d in differences))
+            if ["serving", "playing", "round_ending"][physics.state[i]] != g.game_state:
+                raise AssertionError("game {0} is {1} but the batch has state {2} at step {3}".format(i, g.game_state, physics.state[i], step))
+            if g.paddle1.score != physics.score[PLAYER1, i] or g.paddle2.score != physics.score[PLAYER2, i]:
+                raise AssertionError("game {0} scores differ at step {1}".format(i, step))
+
+            if g.game_state == "round_ending":
+                g.reset_round()
+
+        physics.reset_rounds(physics.state == ROUND_ENDING)
+
+    return largest_difference
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Step many games of pong at once with NumPy.")
+    # Checking against the scalar Game is much slower, so --verify has smaller defaults
+    parser.add_argument("-n", "--games", type=int, default=None, help="number of games to step at once (default 100000, or 20 with --verify)")
+    parser.add_argument("--steps", type=int, default=None, help="number of simulation steps (default 1000, or 2000 with --verify)")
+    parser.add_argument("--seed", type=int, default=None, help="seed for the random number generator (default random, or 0 with --verify)")
+    parser.add_argument("--verify", action="store_true", help="check the results match the scalar Game instead")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.verify:
+        games = 20 if args.games == None else args.games
+        steps = 2000 if args.steps == None else args.steps
+        seed = 0 if args.seed == None else args.seed
+        print("Largest difference from the scalar Game: {0}".format(verify(games, steps, seed)))
+    else:
+        args.games = 100000 if args.games == None else args.games
+        args.steps = 1000 if args.steps == None else args.steps
+        physics, elapsed = run(args.games, args.steps, args.seed)
+        print("Stepped {0} games {1} times in {2:.2f}s ({3:.0f} game steps per second)".format(args.games, args.steps, elapsed, args.games * args.steps / elapsed))
+        print("Points scored: {0}".format(int(physics.score.sum() - 2 * args.games)))
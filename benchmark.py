@@ -0,0 +1,231 @@
+# Micro and macro benchmarks of the game's hot paths, run against a fake in-memory terminal stream.
+# Results can be saved as a JSON baseline and later runs compared against it, e.g.
+#   python benchmark.py run --save baseline.json
+#   (make some changes)
+#   python benchmark.py compare baseline.json
+# compare exits with status 1 if any benchmark got slower than the threshold allows.
+# Unlike profile.sh this doesn't need anyone to play the game, so runs can be repeated exactly.
+import argparse
+import json
+import logging
+import platform
+import random
+import sys
+import blessed
+import clock
+import config
+import game
+import notes
+import simulate
+
+class FakeStream:
+    """
+    A terminal stream which throws away everything written to it, but counts the bytes.
+    """
+    def __init__(self):
+        self.bytes_written = 0
+
+    def write(self, data):
+        self.bytes_written += len(data)
+
+    def flush(self):
+        pass
+
+def make_game(seed=0):
+    """
+    Returns a Game which draws to a fake stream, with two simulate.track_ball players.
+    Frames are written straight to the stream rather than through the output writer thread, so writing is included in the timings.
+    """
+    config.output_writer_thread = False
+    terminal = blessed.Terminal(kind="xterm-256color", force_styling=True, stream=FakeStream())
+    random.seed(seed)
+    g = game.Game(terminal, input_sources=[simulate.track_ball, simulate.track_ball], seed=seed)
+    g.reset_round()
+    g.draw()
+    return g
+
+def time_calls(func, setup=None, number=1000, repeat=5):
+    """
+    Calls func number times, repeat times over, and returns the quickest average time per call in seconds.
+    If setup is given it is called before every call of func, outside of the timing.
+    The quickest run is used since slower runs are slowed down by other things happening on the machine, not by func.
+    """
+    best = None
+    for r in range(repeat):
+        total = 0.0
+        for i in range(number):
+            if setup != None:
+                setup()
+            start_time = clock.now()
+            func()
+            total += clock.now() - start_time
+        average = total / number
+        if best == None or average < best:
+            best = average
+    return best
+
+def bench_render_square():
+    """
+    Times drawing one changed square and rendering the frame, including the escape sequences, printing and flushing.
+    Each call draws the next square of the grid, filling it in if it's blank and blanking it if not, so it's always a change.
+    """
+    g = make_game()
+    squares = [(x, y) for y in range(config.game_height) for x in range(config.game_width)]
+    square = [None, None, None]
+    def setup():
+        # Carry the last frame over, so only the one square differs from what's on screen
+        game.renderer.back = dict(game.renderer.front)
+        game.renderer.back_priority = dict(game.renderer.front_priority)
+        x, y = squares.pop()
+        squares.insert(0, (x, y))
+        square[:] = [x, y, "" if (x, y) in game.renderer.front else "on_green"]
+    def render_square():
+        game.draw_square(*square)
+        game.render_frame()
+    return time_calls(render_square, setup=setup, number=1000)
+
+def bench_draw_after_reset():
+    g = make_game()
+    return time_calls(g.draw, setup=g.reset_round, number=100)
+
+def bench_redraw_steady():
+    g = make_game()
+    g.serve_ball()
+    def step():
+        # Only the redraw is timed, but the game carries on between redraws so the ball and paddles move like in a real game
+        g.handle_input()
+        g.update()
+        if g.game_state == "round_ending":
+            g.reset_round()
+            g.serve_ball()
+    return time_calls(g.redraw, setup=step, number=500)
+
+def place_ball(g, x, y, vx, vy):
+    """
+    Returns a setup function which puts the game into the playing state with the ball at the given position and velocity.
+    """
+    def setup():
+        g.game_state = "playing"
+        for paddle in [g.paddle1, g.paddle2]:
+            paddle.y = config.game_height / 2 - 1
+            paddle.vy = 0.0
+        g.ball.x = x
+        g.ball.y = y
+        g.ball.vx = vx
+        g.ball.vy = vy
+    return setup
+
+def bench_update_free():
+    g = make_game()
+    return time_calls(g.update, setup=place_ball(g, config.game_width / 2.0, config.game_height / 2.0, 0.5, 0.25))
+
+def bench_update_wall():
+    g = make_game()
+    return time_calls(g.update, setup=place_ball(g, config.game_width / 2.0, 0.25, 0.5, -0.5))
+
+def bench_update_paddle():
+    g = make_game()
+    return time_calls(g.update, setup=place_ball(g, config.paddle_offset + 1.25, config.game_height / 2.0, -0.5, 0.0))
+
+def bench_calc_score_positions():
+    g = make_game()
+    g.paddle1.score = 10
+    g.paddle2.score = 10
+    return time_calls(g.user_interface.calc_score_positions)
+
+def bench_transpose():
+    return time_calls(lambda: notes.transpose("C#4", 5), number=10000)
+
+def bench_rally_fps():
+    """
+    Plays a scripted rally between two simulate.track_ball players, running a simulation step and a redraw each frame with no sleeping.
+    Returns frames per second.
+    """
+    g = make_game(seed=1)
+    frames = 2000
+    start_time = clock.now()
+    for i in range(frames):
+        g.handle_input()
+        g.update()
+        g.redraw()
+        if g.game_state == "round_ending":
+            g.reset_round()
+    return frames / (clock.now() - start_time)
+
+# (name, function, unit, whether a higher value is better)
+benchmarks = [
+        ("render_square", bench_render_square, "us", False),
+        ("draw_after_reset", bench_draw_after_reset, "us", False),
+        ("redraw_steady", bench_redraw_steady, "us", False),
+        ("update_free", bench_update_free, "us", False),
+        ("update_wall", bench_update_wall, "us", False),
+        ("update_paddle", bench_update_paddle, "us", False),
+        ("calc_score_positions", bench_calc_score_positions, "us", False),
+        ("transpose", bench_transpose, "us", False),
+        ("rally_fps", bench_rally_fps, "fps", True)
+        ]
+
+def run_benchmarks(names=None):
+    """
+    Runs the benchmarks with the given names, or all of them, and returns a dict of results.
+    """
+    results = {}
+    for name, func, unit, higher_is_better in benchmarks:
+        if names and name not in names:
+            continue
+        value = func()
+        if unit == "us":
+            value *= 1000000
+        results[name] = {"value": value, "unit": unit, "higher_is_better": higher_is_better}
+        print("{0:<22} {1:>12.2f} {2}".format(name, value, unit))
+    return results
+
+def compare(baseline, results, threshold):
+    """
+    Prints how each result changed from the baseline and returns the names of those which got worse by more than threshold, e.g. 0.1 for 10%.
+    """
+    regressions = []
+    for name in sorted(results.keys()):
+        if name not in baseline:
+            continue
+        old = baseline[name]["value"]
+        new = results[name]["value"]
+        change = (new - old) / old if old else 0.0
+        worse = -change if results[name]["higher_is_better"] else change
+        flag = ""
+        if worse > threshold:
+            regressions.append(name)
+            flag = " REGRESSION"
+        print("{0:<22} {1:>12.2f} -> {2:>12.2f} {3:<4} {4:>+8.1%}{5}".format(name, old, new, results[name]["unit"], change, flag))
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the game's hot paths against a fake terminal.")
+    subparsers = parser.add_subparsers(dest="command")
+    run_parser = subparsers.add_parser("run", help="run the benchmarks")
+    run_parser.add_argument("--save", help="save the results to this file as a JSON baseline")
+    run_parser.add_argument("names", nargs="*", help="only run these benchmarks")
+    compare_parser = subparsers.add_parser("compare", help="run the benchmarks and compare them against a saved baseline")
+    compare_parser.add_argument("baseline", help="JSON baseline saved by run --save")
+    compare_parser.add_argument("--threshold", type=float, default=0.1, help="flag benchmarks which are worse by more than this fraction (default: 0.1)")
+    compare_parser.add_argument("names", nargs="*", help="only run these benchmarks")
+    args = parser.parse_args()
+
+    # Only log warnings and errors, since debug logging every step would dominate the timings
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.command == "run":
+        results = run_benchmarks(args.names)
+        if args.save:
+            with open(args.save, "w") as f:
+                baseline = {"python": platform.python_version(), "machine": platform.machine(), "results": results}
+                json.dump(baseline, f, indent=4, sort_keys=True)
+    else:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        results = run_benchmarks(args.names)
+        print("")
+        regressions = compare(baseline["results"], results, args.threshold)
+        if regressions:
+            print("{0} benchmarks regressed by more than {1:.0%}: {2}".format(len(regressions), args.threshold, ", ".join(regressions)))
+            sys.exit(1)
@@ -0,0 +1,30 @@
+import time
+
+# now() returns the time in seconds from a monotonic clock, which unlike time.time() never jumps when the system clock is changed (e.g. by NTP on the Pi).
+# Only differences between two values of now() are meaningful.
+try:
+    now = time.perf_counter # Python 3
+except AttributeError:
+    # Python 2 has no monotonic clock in the time module, so call clock_gettime directly
+    import ctypes
+    import ctypes.util
+
+    CLOCK_MONOTONIC = 1 # from <linux/time.h>
+
+    class timespec(ctypes.Structure):
+        _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+    try:
+        librt = ctypes.CDLL(ctypes.util.find_library("rt") or "librt.so.1", use_errno=True)
+        clock_gettime = librt.clock_gettime
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+
+        def now():
+            t = timespec()
+            if clock_gettime(CLOCK_MONOTONIC, ctypes.byref(t)) != 0:
+                errno = ctypes.get_errno()
+                raise OSError(errno, "clock_gettime failed")
+            return t.tv_sec + t.tv_nsec * 1e-9
+    except (OSError, AttributeError):
+        # Not on Linux, so fall back to the wall clock
+        now = time.time
@@ -0,0 +1,47 @@
+# Swept (continuous) collision detection for the ball.
+# Instead of checking where the ball is at the end of a step, these functions find the exact time during the step that the ball hits something.
+# Times are measured in simulation steps, so a ball at (x, y) with velocity (vx, vy) is at (x + vx*t, y + vy*t) at time t.
+
+# The most things the ball can bounce off in a single step. This stops the ball bouncing forever if it gets stuck in a corner.
+max_bounces_per_step = 4
+
+def wall_time(y, vy, top, bottom, t_max):
+    """
+    Returns the time at which a ball at y moving with velocity vy reaches the top or bottom wall, or None if it doesn't before t_max.
+    A ball which is already past the wall it is moving towards hits it straight away, at time 0.
+    """
+    if vy < 0:
+        t = (top - y) / vy
+    elif vy > 0:
+        t = (bottom - y) / vy
+    else:
+        return None
+
+    if t > t_max:
+        return None
+    return max(t, 0.0)
+
+def box_time(x, y, vx, vy, left, right, top, bottom, t_max):
+    """
+    Returns the earliest time in [0, t_max] at which the ball is inside the box, or None if it never is.
+    If the ball starts inside the box the time is 0.
+    This works by finding the range of times the ball is between the box's left and right edges, and the range it's between the top and bottom edges.
+    The ball is inside the box where the two ranges overlap.
+    """
+    t_enter = 0.0
+    t_exit = t_max
+    for start, velocity, low, high in [(x, vx, left, right), (y, vy, top, bottom)]:
+        if velocity == 0:
+            if start < low or start > high:
+                return None
+        else:
+            t_low = (low - start) / velocity
+            t_high = (high - start) / velocity
+            if t_low > t_high:
+                t_low, t_high = t_high, t_low
+            t_enter = max(t_enter, t_low)
+            t_exit = min(t_exit, t_high)
+            if t_enter > t_exit:
+                return None
+
+    return t_enter
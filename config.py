@@ -5,7 +5,9 @@ def is_running_on_pi():
 
 game_width = 80
 game_height = 20
-game_fps = 32
+game_fps = 32 # render rate
+game_sim_rate = 32 # simulation steps per second. All speeds below are in squares per simulation step.
+game_max_catch_up_steps = 4 # the most simulation steps that will be run in one frame to catch up after a slow frame
 game_score_needed_to_win = 10
 game_over_pause_time = 4.0
 ball_init_speed = 0.5
@@ -16,23 +18,60 @@ paddle_speed = 0.6
 paddle_max_stretches = 2 # How many times can the player stretch the paddle per game
 paddle_stretch_duration = 15.0
 
+# Set either of these to "easy", "medium" or "hard" to have the computer control that player's paddle, or None for a human player
+player1_cpu = None
+player2_cpu = None
+ai_time_budget = 0.001 # the most time in seconds an AI player's decision should take each step. Overruns are counted and logged, not cut short.
+# The terminal doesn't say when a key is released, so keys count as held for a while after each press. See players.Keyboard.
+keyboard_tap_time = 0.05 # seconds a single press counts as held, so a tap moves the paddle for a step or two
+keyboard_repeat_delay = 0.7 # a press this many seconds or less after the last press of the same key is taken as an auto-repeat, meaning the key is being held. It should be longer than the OS's delay before auto-repeat starts (usually 250-660ms).
+keyboard_release_time = 0.1 # once a key is auto-repeating, seconds it counts as held after each repeat. It should be longer than the gap between repeats.
+
 # The maximum and minimum numbers that can be returned by the adc
 adc_max_val = 4096
 adc_min_val = 0
-adc_updates_per_sec = 5
+adc_updates_per_sec = 100 # how often both movement channels are sampled. The buttons don't depend on this since they are read by edge callbacks.
 
 adc_using_p1_ldr = False # Whether an LDR is being used for the player1 controller
 adc_ldr_max_val = 4096
 adc_ldr_min_val = 2200
 
+# The adc's movement readings are filtered before they move a paddle. See adc_filter.py.
+adc_filter_min_cutoff = 1.0 # Hz. Lower values smooth out more jitter while the controller is still.
+adc_filter_beta = 0.5 # how much the smoothing eases off as the controller moves faster, so quick moves don't lag
+adc_filter_outlier_threshold = 0.5 # a reading which jumps further than this (on a scale of -1 to 1) is ignored unless the next reading agrees with it
+adc_filter_prediction_time = 0.02 # seconds past the last reading that the position is predicted, to hide the sampling delay
+adc_filter_deadband = 0.05 # positions this close to the middle (on a scale of -1 to 1) keep the paddle still
+adc_trace_file = None # set to e.g. "adc_trace.csv" to record every adc reading, for trying out filter settings with adc_filter.py
+
 gpio_pin_p1_stretch = 4 # pins 4 and 18 are located on the back of the adc board
 gpio_pin_p1_serve = 18 
 gpio_pin_p2_stretch = 9 # pins 9 and 11 are located on the far right of the base board, just left of pin 10
 gpio_pin_p2_serve = 11 
 gpio_pin_music = 10
+gpio_bounce_time = 30 # milliseconds after a button press during which further edges are ignored, to debounce the switches
 
 output_down_serial_cable = False
 serial_baud_rate = 115200
+output_writer_thread = True # Write frames from the event loop's executor thread so a slow serial cable can't stall the game loop
+serial_budgeted_rendering = True # Limit the bytes sent each frame to what the serial cable can carry, spreading low priority drawing over several frames
+
+# Logging goes to game.log through gamelog.py. "DEBUG" logs every step, which is useful for tracking down bugs but slows the game down.
+log_level = "INFO"
+log_ring_capacity = 10000 # how many recent log records are kept in memory and dumped to game_crash.log if the game crashes, or game_over.log when it ends
+
+telemetry = False # Record timings for every frame and print stats when the game exits
+telemetry_hud = False # Also show frame time stats on the row under the game, updated once a second
+
+replay_file = "game.rpl" # Every match is recorded to this file so it can be played back with replay.py. None turns recording off.
+
+# Networked play with netplay.py
+net_port = 7777
+net_input_delay = 2 # simulation steps between reading a local input and using it, to give it time to reach the other machine
+net_max_rollback = 8 # the most steps the game will guess the other player's inputs for before waiting for them
+
+# Set this to a port number to let people watch the game with e.g. "telnet <address> 7778". See spectators.py.
+spectator_port = None
 
 enable_music = True
 enable_leds = True
@@ -0,0 +1,53 @@
+import logging
+
+# The names of every terminal colour/style used by the game objects and the game over text.
+# An empty name means the terminal's normal colour.
+palette_names = ["", "on_green", "on_blue", "on_red", "on_white", "white", "blue", "red", "bold"]
+
+def encode(text):
+    """
+    Converts an escape sequence from the terminal library into bytes ready to be written to the stream.
+    """
+    if isinstance(text, bytes):
+        return text
+    return text.encode("utf-8")
+
+class EscapeTable:
+    """
+    A table of pre-encoded escape sequences for every square of the game grid and every colour in the palette.
+    Building it calls into the terminal library a few thousand times, but afterwards drawing a square is just a couple of list/dict lookups.
+    The table should be rebuilt whenever the terminal is resized.
+    """
+    def __init__(self, terminal, width, height):
+        self.width = width
+        self.height = height
+        self.rebuild(terminal)
+
+    def rebuild(self, terminal):
+        logging.info("escapes: Building escape table for a %sx%s grid", self.width, self.height)
+        t = terminal
+        self.terminal_width = t.width
+
+        # move[y][x] moves the cursor to the square (x, y)
+        self.move = [[encode(t.move(y, x)) for x in range(self.width)] for y in range(self.height)]
+
+        # Relative moves, indexed by the number of squares moved. Index 0 is an empty string.
+        self.move_right = [b""] + [encode(t.move_right(n)) for n in range(1, self.width + 1)]
+        self.move_left = [b""] + [encode(t.move_left(n)) for n in range(1, self.width + 1)]
+        self.move_down = [b""] + [encode(t.move_down(n)) for n in range(1, self.height + 1)]
+
+        # below moves the cursor to the start of the row under the grid, where text such as the telemetry HUD can go
+        self.below = encode(t.move(self.height, 0))
+
+        # A carriage return followed by line feeds, indexed by the number of rows moved down
+        self.next_line = [b"\r" + b"\n" * n for n in range(0, self.height + 1)]
+
+        self.colours = {}
+        for name in palette_names:
+            if name == "":
+                self.colours[name] = encode(t.normal)
+            else:
+                self.colours[name] = encode(getattr(t, name))
+
+        self.normal = encode(t.normal)
+        self.clear = encode(t.clear)
@@ -0,0 +1,57 @@
+import logging
+
+# A zero-copy view of part of a bytearray which can be passed straight to a stream's write method.
+try:
+    view_bytes = buffer # Python 2
+except NameError:
+    def view_bytes(data, offset, size):
+        return memoryview(data)[offset:offset + size]
+
+class FrameBuilder:
+    """
+    Collects the bytes making up one frame of output so they can be written to the stream in a single call.
+    The bytes are kept in a preallocated bytearray which is reused for every frame, so appending doesn't build up lots of intermediate strings.
+    The bytearray only grows if a frame is larger than anything seen before.
+    """
+    def __init__(self, capacity=4096):
+        self.buffer = bytearray(capacity)
+        self.size = 0 # number of bytes in the current frame
+        self.last_frame_size = 0 # number of bytes in the last frame written
+
+    def append(self, data):
+        """
+        Adds some already encoded bytes to the current frame.
+        """
+        end = self.size + len(data)
+        self.buffer[self.size:end] = data
+        self.size = end
+
+    def frame(self):
+        """
+        Returns a view of the current frame's bytes without copying them.
+        """
+        return view_bytes(self.buffer, 0, self.size)
+
+    def reset(self):
+        """
+        Empties the current frame, keeping the memory allocated for the next one.
+        """
+        self.last_frame_size = self.size
+        self.size = 0
+
+    def write_to(self, stream):
+        """
+        Writes the current frame to the stream in one call, flushes the stream and then starts a new frame.
+        Returns the number of bytes written.
+        """
+        if self.size > 0:
+            stream.write(self.frame())
+
+        try:
+            stream.flush()
+        except Exception:
+            logging.error("frame_builder: Could not flush stream!")
+
+        size = self.size
+        self.reset()
+        return size
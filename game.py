@@ -1,12 +1,19 @@
 from blessed import Terminal 
 import random
-import time
-import Queue
-import threading
 import logging
 import math
-import datetime
+from array import array
 import config
+import clock
+import collision
+import players
+import runtime
+from predictor import Predictor
+from renderer import Renderer, CursorMover, PRIORITY_HIGH, PRIORITY_LOW
+from escapes import EscapeTable, encode
+from frame_builder import FrameBuilder
+from output_writer import OutputWriter
+from telemetry import Telemetry
 
 if config.is_running_on_pi():
     import hardware_input
@@ -19,78 +26,235 @@ if config.is_running_on_pi():
 # This value is set when a Game is created.
 terminal = None
 
-print_text_buffer = ""
+# We also keep a global reference to the renderer, which game objects paint into through draw_square.
+# This value is also set when a Game is created.
+renderer = None
+
+# The cursor mover keeps track of the terminal's cursor so that it can be moved as cheaply as possible.
+# This value is also set when a Game is created.
+cursor = None
+
+# The escape table holds pre-encoded escape sequences for every square and colour, so drawing doesn't need to call into the terminal library.
+# This value is also set when a Game is created, and rebuilt when the terminal is resized.
+escapes = None
+
+# The frame builder collects the encoded bytes of each frame so they can be written with a single call
+frame_builder = FrameBuilder()
+
+# If config.output_writer_thread is set, frames are written to the terminal's stream on the event loop's executor thread.
+# This value is set when a Game is created.
+output_writer = None
+
+# If set to a spectators.SpectatorServer, every frame is also sent to anyone watching over the network
+spectator_server = None
+
 def print_text(text, buffered=True):
     """
     If outputting down a serial cable, the terminal's stream will be the serial port object and the text will go down the serial cable.
     If not, the stream will be STDOUT and it will be printed to screen.
-    The buffered argument is True by default and will cause text to be saved up in print_text_buffer. It can then be actually printed later by calling print_text_flush_buffer, which also clears the buffer. This minimizes the number of actual stream writes needed.
+    The buffered argument is True by default and will cause text to be saved up in frame_builder. It can then be actually printed later by calling print_text_flush_buffer, which also starts a new frame. This minimizes the number of actual stream writes needed.
     """
-    global print_text_buffer
     if buffered:
-        print_text_buffer += text
+        frame_builder.append(encode(text))
     else:
-        terminal.stream.write(text)
+        terminal.stream.write(encode(text))
 
 def print_text_flush_buffer():
-    global print_text_buffer
-    terminal.stream.write(print_text_buffer)
-
-    try:
-        terminal.stream.flush()
-    except Exception:
-        logging.error("Terminal could not flush stream!")
+    """
+    Writes the current frame to the terminal's stream and returns the number of bytes written.
+    If there is an output writer the frame is handed to it instead, so this never blocks on the stream.
+    """
+    # An empty frame is still published if a spectator is waiting for a keyframe, otherwise they would see nothing until something on screen changed
+    if spectator_server != None and (frame_builder.size > 0 or spectator_server.keyframe_wanted):
+        keyframe = build_keyframe() if spectator_server.keyframe_wanted else None
+        spectator_server.publish(bytes(frame_builder.frame()), keyframe)
+
+    if output_writer != None:
+        size = frame_builder.size
+        if size > 0:
+            # The frame is copied out of the frame builder so it can carry on with the next frame while the executor thread sends this one
+            output_writer.submit(bytes(frame_builder.frame()))
+        frame_builder.reset()
+    else:
+        size = frame_builder.write_to(terminal.stream)
+    logging.debug("print_text_flush_buffer: wrote %s bytes", size)
+    return size
 
-    print_text_buffer = ""
+def build_keyframe():
+    """
+    Returns the bytes to redraw the whole screen as the renderer last drew it, for a spectator who has just started watching.
+    Afterwards the cursor and colour are left as they are on the real terminal, so the following frames draw correctly on top.
+    """
+    parts = [escapes.normal, escapes.clear]
+    colour = ""
+    for (x, y), square_colour in sorted(renderer.front.items(), key=lambda item: (item[0][1], item[0][0])):
+        if square_colour == None:
+            continue # not known yet, so it's left blank like the spectator's cleared screen
+        parts.append(escapes.move[y][x])
+        if square_colour != colour:
+            parts.append(escapes.colours[square_colour])
+            colour = square_colour
+        parts.append(b" ")
+
+    parts.append(escapes.normal)
+    if previous_square_colour:
+        parts.append(escapes.colours[previous_square_colour])
+    if cursor.x != None:
+        # The cursor can be just past the last column of the grid after drawing a square there
+        last_x = min(cursor.x, renderer.width - 1)
+        parts.append(escapes.move[cursor.y][last_x] + escapes.move_right[cursor.x - last_x])
+    return b"".join(parts)
+
+def wait_for_output():
+    """
+    Blocks until everything printed so far has actually been written to the terminal's stream.
+    """
+    if output_writer != None:
+        output_writer.wait_until_idle()
 
 # This function provides an interface for game objects to draw squares to the screen.
+# The square is painted into the renderer's back buffer. It only reaches the screen when render_frame is called, and only if it changed since the last frame.
+# Squares which don't need to be drawn straight away, such as the net and scores, can be given a low priority.
+def draw_square(x, y, colour="", priority=PRIORITY_HIGH):
+    if renderer == None:
+        raise RuntimeError("draw_square called but renderer has not been set. Have you created a Game object yet?")
+
+    renderer.paint(x, y, colour, priority)
+
+# This function actually prints a square to the screen.
 # It allows for some optimizations - for example if the same colour square is to be drawn more than once, the colour escape code will be sent only once.
 previous_square_colour = None
-def draw_square(x, y, colour=""):
+def print_square(x, y, colour=""):
     if terminal == None:
-        raise RuntimeError("draw_square called but terminal has not been set. Have you created a Game object yet?")
+        raise RuntimeError("print_square called but terminal has not been set. Have you created a Game object yet?")
+
+    global previous_square_colour
+    x = int(x)
+    y = int(y)
+
+    # The squares in between the cursor and this square can be written over if they are already showing the current colour.
+    # Squares which are still to be drawn this frame always come after this one, so they are never written over.
+    def can_fill(start_x, end_x, row):
+        for i in range(start_x, end_x):
+            if renderer.front.get((i, row), "") != previous_square_colour:
+                return False
+        return True
 
-    print_text(terminal.move(int(y), int(x)))
+    print_text(cursor.move_to(x, y, can_fill))
 
     # Check to see if the new colour is different to the last colour.
     # This minimizes the number of colour changes needed.
-    global previous_square_colour
+    # Colours are given by name, e.g. "on_green". An empty name is the terminal's normal colour.
     if previous_square_colour != colour:
-        if colour == "":
-            print_text(terminal.normal + " ")
-        else:
-            print_text(colour + " ")
-
+        print_text(escapes.colours[colour])
+        print_text(b" ")
         previous_square_colour = colour
     else:
-        print_text(" ")
-
-# This function is used only when running on a PC (not on the Pi) and allows the game to be played with keyboard input.
-# It will be ran in a seperate thread when the game is started.
-def keyboard_input_worker(queue):
-    while True:
-        with terminal.cbreak():
-            # Wait for a key to be pressed, blocking indefinitely
-            key = terminal.inkey(timeout=None)
-            logging.info("keyboard: got key: {}".format((str(key), key.name, key.code)))
-            if key.name != None:
-                # Special keys e.g. left right etc. have a descriptive name like 'KEY_LEFT' # Normal keys like a,b,c don't have a key.name attribute
-                queue.put(key.name)
-            else:
-                queue.put(str(key))
+        print_text(b" ")
+
+    cursor.advance()
+
+def render_frame(byte_budget=None):
+    """
+    Prints every square which changed since the last frame and then flushes the output buffer. Returns the number of bytes written.
+    If the output writer still has the last frame waiting to be sent, this frame is skipped. The changed squares stay dirty so they are sent with the next frame.
+    If byte_budget is given, the high priority squares are printed first. Low priority squares are then printed until the frame would go over budget, and the rest are left for later frames.
+    """
+    if output_writer != None and not output_writer.ready():
+        logging.debug("render_frame: Output writer is behind so skipping this frame")
+        return 0
+
+    if byte_budget == None:
+        for priority, y, x, colour in renderer.dirty_cells():
+            print_square(x, y, colour)
+
+        renderer.swap()
+    else:
+        for priority, y, x, colour in renderer.dirty_cells(by_priority=True):
+            if priority != PRIORITY_HIGH:
+                # The most a square can cost is an absolute move, a colour change and the space itself
+                worst_case_size = len(escapes.move[y][x]) + len(escapes.colours[colour]) + 1
+                if frame_builder.size + worst_case_size > byte_budget:
+                    logging.debug("render_frame: Byte budget used up so leaving the remaining squares for later frames")
+                    break
+
+            print_square(x, y, colour)
+            renderer.mark_drawn(x, y, colour, priority)
 
+    return print_text_flush_buffer()
+
+def clear_screen(byte_budget=None):
+    """
+    Clears the whole screen. The renderer is told about it so that every square gets drawn again on the next frame.
+    If byte_budget is given the screen isn't cleared straight away, since drawing everything again in one frame would go far over budget.
+    Instead every square of the grid is marked as unknown, so render_frame erases them as low priority squares over the next few frames. Anything outside the grid is left as it is.
+    """
+    global previous_square_colour
+    if byte_budget == None:
+        print_text(escapes.normal + escapes.clear)
+        previous_square_colour = ""
+        renderer.invalidate()
+    else:
+        # The colour the terminal is set to isn't known either, so it's always sent with the next square
+        previous_square_colour = None
+        renderer.mark_unknown()
+    cursor.forget()
 
 class Game:
-    def __init__(self, term):
-        # term is a blessed.Terminal object
-        # set the global variable terminal for ease of access
-        global terminal
-        terminal = term
+    def __init__(self, term, byte_budget=None, input_sources=None, seed=None):
+        # term is a blessed.Terminal object, or None for a headless game which has no output. Headless games are run with play_headless.
+        # byte_budget is the most bytes that should be sent each frame, or None for no limit. It's used when outputting down the serial cable.
+        # input_sources is an optional pair of input sources for player1 and player2 - see players.py. If not given, the players are chosen by config.py.
+        # seed seeds the game's random number generator, so that a match can be played again exactly. None means a random seed, which is kept in self.seed so the match can still be replayed.
+        self.headless = term == None
+        if seed == None:
+            seed = random.SystemRandom().randrange(2**63)
+        self.seed = seed
+        self.rng = random.Random(seed)
+
+        # The number of simulation steps so far
+        self.step_count = 0
+
+        # The predictor is shared by anything that wants to know where the ball is going, e.g. AI players
+        self.predictor = Predictor()
+
+        # play runs the game on this event loop, along with the input readers, LED effects and music. Headless games don't need one.
+        self.loop = None
+
+        if not self.headless:
+            self.loop = runtime.EventLoop()
+
+            # set the global variable terminal for ease of access
+            global terminal, renderer, cursor, escapes, output_writer
+            terminal = term
+
+            # The ball can sit on the row just below the bottom wall, so the grid is one row taller than the game
+            renderer = Renderer(config.game_width, config.game_height + 1)
+            escapes = EscapeTable(terminal, renderer.width, renderer.height)
+            cursor = CursorMover(escapes)
+            if config.output_writer_thread:
+                output_writer = OutputWriter(terminal.stream, self.loop.executor)
 
         self.width = config.game_width
         self.height = config.game_height
         self.fps = config.game_fps
 
+        # Keep a note of how many bytes the last frame took, and what fraction of the byte budget that was
+        self.byte_budget = byte_budget
+        self.last_frame_bytes = 0
+        self.last_frame_budget_used = 0.0
+
+        # If config.telemetry is set, play records timings for every frame into this
+        self.telemetry = None
+
+        # If set to a replay.Recorder, the players' inputs for every simulation step are recorded so the match can be replayed
+        self.recorder = None
+
+        # Getting the random number generator's state is the slowest part of a snapshot, so the last one is kept along with the ball's trajectory at the time.
+        # The generator is only used when the ball is reset or bounces off a paddle, which both change the trajectory, so the state is still valid while the trajectory is the same.
+        self.snapshot_rng_trajectory = None
+        self.snapshot_rng_state = None
+
         # Valid game states are:
         # serving - between the round beginning and the player pressing serve
         # playing - while the ball is in motion
@@ -98,19 +262,35 @@ class Game:
         # game_ending - after a player has reached the needed score to win
         self.game_state = "serving"
 
-        self.ball = Ball()
+        self.ball = Ball(self.rng)
         self.paddle1 = Paddle("player1")
         self.paddle2 = Paddle("player2")
         self.user_interface = UserInterface(self.ball, self.paddle1, self.paddle2)
 
         self.player_serving = "player1"
 
+        # Statistics about the match so far. These are used by the batch runner.
+        self.stats = {
+                "points": 0,
+                "paddle_bounces": 0,
+                "wall_bounces": 0,
+                "longest_rally": 0, # the most paddle bounces in a single point
+                "steps": 0 # simulation steps played by play_headless
+                }
+        self.current_rally = 0
+
         # Save a list of all game objects. This is useful for when they need to be iterated over.
-        # Note the order of objects in the list also determines render order.
+        # Note the order of objects in the list also determines render order - objects earlier in the list are drawn on top.
         self.game_objects = [self.ball, self.paddle1, self.paddle2, self.user_interface]
 
-        self.keyboard_input_thread = None
-        self.keyboard_input_queue  = None
+        # The keyboard is only used if a human player is playing on a PC
+        self.keyboard = None
+        if input_sources == None and not self.headless:
+            input_sources = self.default_input_sources()
+        self.input_sources = input_sources
+
+        if self.headless:
+            return
 
         # Keep a reference to the terminal's width and height and clear/refresh the display if it changes.
         # This helps to prevent display errors.
@@ -118,156 +298,291 @@ class Game:
         self.prev_terminal_height = terminal.height
 
         if config.is_running_on_pi():
-            hardware_input.setup()
+            hardware_input.setup(self.loop)
             if config.enable_leds:
                 leds.setup()
             if config.enable_music:
-                music.start_theme_music()
-
-    def init_keyboard_input_thread(self):
-        # This queue is used for communication between the keyboard input thread and the main thread
-        # When a key is pressed it is placed onto the queue
-        # It is then popped off the queue in the main thread
-        self.keyboard_input_queue = Queue.Queue(maxsize=1)
-        self.keyboard_input_thread = threading.Thread(target=keyboard_input_worker, args=(self.keyboard_input_queue,))
+                music.start_theme_music(self.loop)
 
-        # Setting the thread to a daemon means it will end when the main thread ends
-        self.keyboard_input_thread.setDaemon(True)
-        self.keyboard_input_thread.start()
+    def default_input_sources(self):
+        """
+        Returns the input sources for each player according to config.py.
+        Computer players are used if config.player1_cpu or config.player2_cpu are set. Otherwise the adc is used on the Pi, or the keyboard on a PC.
+        """
+        sources = []
+        for player_id, cpu_difficulty in [("player1", config.player1_cpu), ("player2", config.player2_cpu)]:
+            if cpu_difficulty != None:
+                logging.debug("%s is a %s computer player.", player_id, cpu_difficulty)
+                sources.append(players.AIPlayer(cpu_difficulty))
+            elif config.is_running_on_pi():
+                sources.append(players.HardwareInput(player_id))
+            else:
+                if self.keyboard == None:
+                    self.keyboard = players.Keyboard(terminal)
+                if player_id == "player1":
+                    sources.append(players.KeyboardInput(self.keyboard, up="w", down="s", serve="e", stretch="r"))
+                else:
+                    sources.append(players.KeyboardInput(self.keyboard, up="i", down="k", serve="o", stretch="p"))
+        return sources
 
     def play(self):
-        if not config.is_running_on_pi():
-            logging.debug("Initializing keyboard input thread since we're not on the Pi.")
-            self.init_keyboard_input_thread()
-        else:
-            logging.debug("On the Pi so not using keyboard input.")
+        """
+        Plays the match in real time until someone wins.
+        Each frame is a tick on the event loop, which also runs the keyboard, hardware input, LED effects and music in between frames.
+        """
+        if self.keyboard != None:
+            self.keyboard.start(self.loop)
 
         self.reset_round()
 
-        while True:
-            # Time the duration of the frame and adjust the sleep duration accordingly.
-            # This improves fps accuracy on the Pi.
-            frame_start_time = datetime.datetime.now()
-
+        # The simulation runs at a fixed rate, config.game_sim_rate, which is separate from the render rate, self.fps.
+        # Real time that has passed is added to the accumulator, and a simulation step is run for every sim_step_time in it.
+        # This means the game speed stays the same even if some frames take longer to render.
+        self.sim_step_time = 1 / float(config.game_sim_rate)
+        self.frame_time = 1 / float(self.fps)
+        self.accumulator = 0.0
+        self.previous_time = clock.now()
+
+        if config.telemetry:
+            self.telemetry = Telemetry(self.frame_time)
+            if self.keyboard != None:
+                self.keyboard.latency = self.telemetry.key_latency
+
+        self.loop.call_later(0, self.tick)
+        try:
+            self.loop.run()
+        finally:
+            if self.keyboard != None:
+                self.keyboard.stop()
+
+    def tick(self):
+        """
+        Runs one frame: any simulation steps which are due, then a redraw.
+        Then schedules the next frame, or the next round, or the end of the game.
+        """
+        telemetry = self.telemetry
+
+        # Time the duration of the frame so the next one can be scheduled a frame_time after this one started.
+        # This improves fps accuracy on the Pi.
+        frame_start_time = clock.now()
+        self.accumulator += frame_start_time - self.previous_time
+        self.previous_time = frame_start_time
+        if telemetry != None:
+            telemetry.begin_frame()
+
+        steps = 0
+        while self.accumulator >= self.sim_step_time and steps < config.game_max_catch_up_steps:
             # Note handle_input must come before update
-            self.handle_input()
-            self.update()
+            if telemetry != None:
+                step_start_time = clock.now()
+                self.handle_input()
+                input_end_time = clock.now()
+                self.update()
+                telemetry.add("input", input_end_time - step_start_time)
+                telemetry.add("update", clock.now() - input_end_time)
+            else:
+                self.handle_input()
+                self.update()
+            self.accumulator -= self.sim_step_time
+            steps += 1
 
-            if terminal.width != self.prev_terminal_width or terminal.height != self.prev_terminal_height:
-                logging.info("Terminal resized so clearing screen.")
-                print_text(terminal.normal + terminal.clear )
-                self.prev_terminal_width = terminal.width
-                self.prev_terminal_height = terminal.height
-                self.draw()
+            if self.game_state == "round_ending":
+                self.accumulator = 0.0
+                break
+
+        if self.accumulator >= self.sim_step_time:
+            # After a long hiccup, don't try to catch up all at once since that would make the game jump forwards. Just let it run slow for a moment.
+            logging.debug("game: Dropping %.3fs of simulation time after running %s catch-up steps", self.accumulator, steps)
+            self.accumulator = 0.0
+
+        draw_start_time = clock.now()
+        if terminal.width != self.prev_terminal_width or terminal.height != self.prev_terminal_height:
+            logging.info("Terminal resized so clearing screen.")
+            escapes.rebuild(terminal)
+            clear_screen(self.byte_budget)
+            self.prev_terminal_width = terminal.width
+            self.prev_terminal_height = terminal.height
+        # Clearing leaves every square dirty, so redraw sends them all again
+        self.redraw()
+
+        frame_end_time = clock.now()
+        if self.keyboard != None:
+            self.keyboard.end_frame()
+        time_delta = frame_end_time - frame_start_time
+        time_to_sleep = max(0, self.frame_time - time_delta)
+        logging.debug("time delta: %s, sleep time: %s, sim steps: %s", time_delta, time_to_sleep, steps)
+
+        if telemetry != None:
+            telemetry.add("draw", frame_end_time - draw_start_time)
+            telemetry.add("bytes", self.last_frame_bytes)
+            telemetry.add("sleep", time_to_sleep)
+            telemetry.end_frame()
+
+        # The screen should not need to be cleared since the renderer erases any square which is no longer drawn
+        logging.debug("-----")
+
+        if self.game_state == "round_ending":
+            winner = self.winner()
+            if winner != None:
+                self.game_over(winner)
+                self.loop.call_later(config.game_over_pause_time, self.loop.stop)
             else:
-                self.redraw()
+                self.next_round()
+        else:
+            self.loop.call_at(frame_start_time + self.frame_time, self.tick)
 
-            frame_end_time = datetime.datetime.now()
-            time_delta = (frame_end_time - frame_start_time).total_seconds()
-            time_to_sleep = max(0, 1/float(self.fps) - time_delta)
-            time.sleep(time_to_sleep)
-            logging.debug("time delta: {0}, sleep time: {1}".format(time_delta, time_to_sleep))
+    def play_headless(self, max_steps=None):
+        """
+        Plays a whole match as fast as possible, with no output and no sleeping. Needs input_sources to be given.
+        Returns the id of the winning player, or None if max_steps simulation steps went by without anyone winning.
+        """
+        self.reset_round()
+
+        steps = 0
+        while max_steps == None or steps < max_steps:
+            self.handle_input()
+            self.update()
+            steps += 1
+            self.stats["steps"] += 1
 
             if self.game_state == "round_ending":
-                if self.paddle1.score >= config.game_score_needed_to_win:
-                    self.game_over("player1")
-                    break
-                elif self.paddle2.score >= config.game_score_needed_to_win:
-                    self.game_over("player2")
-                    break
-                else:
-                    self.next_round()
+                winner = self.winner()
+                if winner != None:
+                    return winner
+                self.reset_round()
+
+        return None
+
+    def snapshot(self):
+        """
+        Returns a snapshot of the whole state of the match, which can be given to restore later to go back to that point.
+        This is cheap enough to take every simulation step, e.g. for rollback in networked play or for seeking within a replay.
+        The input sources aren't included, so an AI player or the keyboard carries on from where it is.
+
+        The first item of the snapshot is a flat tuple of the match's fields, laid out as described by state_layout, so two states can be compared with == or hashed.
+        pack_state turns it into an array of doubles when it needs to be saved or checksummed as a single buffer. That isn't done here, since it would slow down every snapshot.
+        """
+        if self.ball.trajectory != self.snapshot_rng_trajectory:
+            self.snapshot_rng_trajectory = self.ball.trajectory
+            self.snapshot_rng_state = self.rng.getstate()
+
+        stats = self.stats
+        state = ((self.game_state, self.player_serving, self.step_count, self.current_rally,
+                stats["points"], stats["paddle_bounces"], stats["wall_bounces"], stats["longest_rally"], stats["steps"]) +
+                self.ball.snapshot() + self.paddle1.snapshot() + self.paddle2.snapshot())
+
+        ui = self.user_interface
+        return (state, self.snapshot_rng_trajectory, self.snapshot_rng_state, ui.p1_score_positions, ui.p2_score_positions)
+
+    def restore(self, snapshot):
+        """
+        Puts the match back to the state it was in when the snapshot was taken.
+        """
+        state, self.snapshot_rng_trajectory, self.snapshot_rng_state, p1_score_positions, p2_score_positions = snapshot
 
-            # The screen should not need to be cleared since every game object's redraw method should clear it's last position 
-            #print_text(terminal.clear)
-            logging.debug("-----")
+        (self.game_state, self.player_serving, self.step_count, self.current_rally,
+                points, paddle_bounces, wall_bounces, longest_rally, steps) = state[:game_state_size]
+        self.stats = {"points": points, "paddle_bounces": paddle_bounces, "wall_bounces": wall_bounces, "longest_rally": longest_rally, "steps": steps}
+
+        self.ball.restore(state[game_state_size:paddle1_start])
+        self.paddle1.restore(state[paddle1_start:paddle2_start])
+        self.paddle2.restore(state[paddle2_start:])
+        self.rng.setstate(self.snapshot_rng_state)
+
+        # The score positions are replaced rather than changed when the scores change, so the snapshot can share them
+        self.user_interface.p1_score_positions = p1_score_positions
+        self.user_interface.p2_score_positions = p2_score_positions
+
+        # The ball's trajectory counter has gone back, so predictions cached since the snapshot could be mistaken for the current trajectory
+        self.predictor.cache = {}
+        self.predictor.cached_trajectory = None
+
+    def winner(self):
+        """
+        Returns the id of the player who has reached the score needed to win, or None if nobody has yet.
+        """
+        if self.paddle1.score >= config.game_score_needed_to_win:
+            return "player1"
+        elif self.paddle2.score >= config.game_score_needed_to_win:
+            return "player2"
+        return None
 
     def handle_input(self):
-        if config.is_running_on_pi():
-            logging.debug("Running on Pi so checking adc for player input.")
+        """
+        Reads each player's input source and moves the paddles, serves and stretches accordingly.
+        Each input source is called with (game, paddle) and returns a dict like {"vy": paddle velocity, "serve": True/False, "stretch": True/False}.
+        """
+        player_inputs = []
+        for paddle, input_source in zip([self.paddle1, self.paddle2], self.input_sources):
+            player_input = input_source(self, paddle)
+            self.apply_player_input(paddle, player_input)
+            player_inputs.append(player_input)
 
-            p1_input = hardware_input.get_player1_input()
-            p2_input = hardware_input.get_player2_input()
+        if self.recorder != None:
+            self.recorder.record_step(player_inputs)
 
-            # Convert the player movement input to a value between -1 and 1
-            normalize_input = lambda i: ((i - config.adc_min_val)/float((config.adc_max_val - config.adc_min_val)) - 0.5) * 2.0
-            normalize_input_ldr = lambda i: ((i - config.adc_ldr_min_val)/float((config.adc_ldr_max_val - config.adc_ldr_min_val)) - 0.5) * 2.0
+    def apply_player_input(self, paddle, player_input):
+        """
+        Applies an input dict from one of the input sources to the given paddle.
+        """
+        paddle.vy = player_input["vy"]
 
-            if config.adc_using_p1_ldr:
-                p1_normalized = normalize_input_ldr(p1_input["movement"])
-            else:
-                p1_normalized = normalize_input(p1_input["movement"])
-            p2_normalized = normalize_input(p2_input["movement"])
-
-            self.paddle1.vy = p1_normalized * config.paddle_speed
-            self.paddle2.vy = p2_normalized * config.paddle_speed
-
-            # Now check stretch and serve input
-            if self.game_state == "serving":
-                if p1_input["serve"] == 1 and self.player_serving == "player1" or p2_input["serve"] == 1 and self.player_serving == "player2":
-                    self.serve_ball()
-            elif self.game_state == "playing":
-                if p1_input["stretch"] == 1:
-                    self.paddle1.stretch()
-                elif p2_input["stretch"] == 1:
-                    self.paddle2.stretch()
-        else:
-            try:
-                key = self.keyboard_input_queue.get_nowait()
-
-                if key == "w":
-                    self.paddle1.vy = -1
-                elif key == "s":
-                    self.paddle1.vy = 1
-                elif key == "e" and self.game_state == "serving" and self.player_serving == "player1":
-                    self.serve_ball()
-                elif key == "r" and self.game_state == "playing":
-                    self.paddle1.stretch()
-                elif key == "i":
-                    self.paddle2.vy = -1
-                elif key == "k":
-                    self.paddle2.vy = 1
-                elif key == "o" and self.game_state == "serving" and self.player_serving == "player2":
-                    self.serve_ball()
-                elif key == "p" and self.game_state == "playing":
-                    self.paddle2.stretch()
-            except Queue.Empty:
-                # If no keys have been pressed the queue will be empty and this exception will be raised.
-                # It's not a problem so just continue.
-                pass
+        if self.game_state == "serving":
+            if player_input["serve"] and self.player_serving == paddle.id:
+                self.serve_ball()
+        elif self.game_state == "playing":
+            if player_input["stretch"]:
+                paddle.stretch()
 
     def draw(self):
         """
-        The point of draw is to have each game object draw itself to the screen.
-        It is only called on the first frame of each round, or if the terminal has been resized. Aside from these special cases, redraw is always used.
-        The point of this is that redraw cares about erasing the game object's previous position, but draw does not - it simply draws the object.
+        The point of draw is to draw every game object to the screen from scratch.
+        It is only needed after the screen has been cleared, e.g. if the terminal has been resized. Aside from this special case, redraw is always used.
         """
-        logging.info("game: Drawing")
-        for object in self.game_objects:
-            object.draw()
-
-        print_text_flush_buffer()
+        logging.debug("game: Drawing")
+        renderer.invalidate()
+        self.redraw()
 
     def redraw(self):
         """
-        The point of redraw is to have each game object erase it's last position and then draw it's new position.
+        The point of redraw is to have each game object paint itself into the renderer's back buffer.
+        Only the squares which differ from the last frame are then printed.
         This prevents the screen from having to be completely cleared every frame and thus makes the game render more smoothly.
         """
-        logging.info("game: Redrawing")
-        for object in self.game_objects:
-            object.redraw()
+        logging.debug("game: Redrawing")
+        renderer.begin_frame()
+        for object in reversed(self.game_objects):
+            object.draw()
 
-        print_text_flush_buffer()
+        if self.telemetry != None and config.telemetry_hud and self.telemetry.frames % self.fps == 0:
+            self.draw_hud()
+
+        self.last_frame_bytes = render_frame(self.byte_budget)
+        if self.byte_budget != None:
+            self.last_frame_budget_used = self.last_frame_bytes / float(self.byte_budget)
+            logging.debug("game: Frame used %s of %s byte budget", self.last_frame_bytes, self.byte_budget)
+
+    def draw_hud(self):
+        """
+        Prints a line of telemetry stats on the row below the game. It goes out with the next frame.
+        """
+        global previous_square_colour
+        text = self.telemetry.hud_text()[:config.game_width].ljust(config.game_width)
+        print_text(escapes.below + escapes.normal + text)
+        # The text moves the cursor and resets the colour, so the next square needs an absolute move and a colour change
+        cursor.forget()
+        previous_square_colour = None
 
     def update(self):
         """
         Updates all the game objects and then performs collision detection.
         """
-        logging.info("game: Updating. game_state = " + self.game_state)
+        logging.debug("game: Updating. game_state = %s", self.game_state)
+        self.step_count += 1
         for object in self.game_objects:
             object.update()
 
-        if config.is_running_on_pi() and config.enable_leds:
+        if config.is_running_on_pi() and config.enable_leds and not self.headless:
             leds.follow_ball(self.ball)
 
         # Prevent the paddles moving off screen
@@ -292,33 +607,84 @@ class Game:
                 self.ball.y = float(self.paddle2.y + 1)
         else:
             # Perform collision detections
-            # Firstly, check if ball hit walls
+            # Firstly, move the ball along its path, bouncing off any walls and paddles it hits on the way
             b = self.ball # this is less verbose
-            t = terminal
-
-            if b.y <= y_min: 
-                logging.info("game: Ball hit top of screen")
-                b.y = y_min
-                b.vy *= -1
-            elif b.y >= y_max: 
-                logging.info("game: Ball hit bottom of screen")
-                b.y = y_max
-                b.vy *= -1
+            self.move_ball(y_min, y_max)
 
+            # Then check if the ball got past a paddle
             if b.x < 0: # player 1 missed
                 logging.info("game: Player 2 scores")
                 self.paddle2.score += 1
                 self.game_state = "round_ending"
+                self.end_rally()
             elif b.x > self.width-1: # player 2 missed
                 logging.info("game: Player 1 scores")
                 self.paddle1.score += 1
                 self.game_state = "round_ending"
+                self.end_rally()
+
+    def move_ball(self, y_min, y_max):
+        """
+        Works out the ball's path for this step using swept collision detection.
+        Ball.update has already moved the ball by its whole velocity. Here the path from prev_x/prev_y is followed again,
+        and if the ball hits a wall or paddle on the way it is bounced at the exact point it hit, then carries on for the rest of the step with its new velocity.
+        This means a fast ball can't pass through a paddle between one step and the next.
+        """
+        b = self.ball
+        x = b.prev_x
+        y = b.prev_y
+        time_left = 1.0
+
+        for i in range(collision.max_bounces_per_step):
+            # Find whichever the ball hits first, if anything
+            hit_time = collision.wall_time(y, b.vy, y_min, y_max, time_left)
+            hit = "wall" if hit_time != None else None
 
-            # Now check if ball hit paddles
             for paddle in [self.paddle1, self.paddle2]:
-                if paddle.collides_with_ball(b):
-                    logging.info("game: Ball hit paddle")
-                    b.bounce_off_paddle(paddle)
+                if paddle.moving_towards(b):
+                    left_x, right_x, top_y, bottom_y = paddle.hitbox()
+                    t = collision.box_time(x, y, b.vx, b.vy, left_x, right_x, top_y, bottom_y, time_left)
+                    if t != None and (hit_time == None or t < hit_time):
+                        hit_time = t
+                        hit = paddle
+
+            if hit == None:
+                x += b.vx * time_left
+                y += b.vy * time_left
+                break
+
+            # Move the ball to where it hit and bounce it
+            x += b.vx * hit_time
+            y += b.vy * hit_time
+            time_left -= hit_time
+            b.x = x
+            b.y = y
+
+            if hit == "wall":
+                if b.vy < 0:
+                    logging.debug("game: Ball hit top of screen")
+                    y = y_min
+                else:
+                    logging.debug("game: Ball hit bottom of screen")
+                    y = y_max
+                b.vy *= -1
+                self.stats["wall_bounces"] += 1
+            else:
+                logging.info("game: Ball hit paddle")
+                b.bounce_off_paddle(hit)
+                self.stats["paddle_bounces"] += 1
+                self.current_rally += 1
+
+        b.x = x
+        b.y = y
+
+    def end_rally(self):
+        """
+        Records the statistics for a point which has just been scored.
+        """
+        self.stats["points"] += 1
+        self.stats["longest_rally"] = max(self.stats["longest_rally"], self.current_rally)
+        self.current_rally = 0
 
     def serve_ball(self):
         """
@@ -334,49 +700,92 @@ class Game:
             self.ball.vx = -config.ball_init_speed
             self.player_serving = "player2"
 
+        self.ball.trajectory += 1
+
     def reset_round(self):
         logging.info("game: Resetting round")
-        print_text(terminal.normal + terminal.clear)
+        # There's no need to clear the screen here, since the renderer will erase anything left over from the last round
         for object in self.game_objects:
             object.reset()
-            object.draw()
 
         self.game_state = "serving"
-        if config.is_running_on_pi() and config.enable_pyglow:
-            leds.play_pyglow_effect()
+        if config.is_running_on_pi() and config.enable_pyglow and not self.headless:
+            leds.play_pyglow_effect(self.loop)
 
     def next_round(self):
         """
-        Starts the next round after a point has been scored.
+        Starts the next round after a short pause once a point has been scored. The event loop carries on running everything else during the pause.
         """
         logging.info("game: Moving to next round")
-        time.sleep(0.75)
+        self.loop.call_later(0.75, self.start_next_round)
+
+    def start_next_round(self):
         self.reset_round()
 
+        # The pause between rounds shouldn't be caught up on
+        self.accumulator = 0.0
+        self.previous_time = clock.now()
+        self.tick()
+
     def game_over(self, winning_player_id):
         logging.info("game: Game over")
-        self.user_interface.redraw()
+        wait_for_output()
+        self.redraw()
 
         game_over_text = "GAME OVER!"
         if winning_player_id == "player1":
-            winning_text_colour = terminal.blue
+            winning_text_colour = escapes.colours["blue"]
             winning_text = "Player 1 is victorious."
         else:
-            winning_text_colour = terminal.red
+            winning_text_colour = escapes.colours["red"]
             winning_text = "Player 2 is victorious."
 
         # Print game over text in middle of screen
-        print_text(terminal.normal + terminal.bold)
-        print_text(terminal.move_y(config.game_height/2 - 2) + terminal.move_x(config.game_width/2 - len(game_over_text)/2) + terminal.white + game_over_text)
+        print_text(escapes.normal + escapes.colours["bold"])
+        print_text(escapes.move[config.game_height/2 - 2][config.game_width/2 - len(game_over_text)/2] + escapes.colours["white"] + game_over_text)
 
         # Print winning player text one line below it
-        print_text(terminal.move_y(config.game_height/2 - 1) + terminal.move_x(config.game_width/2 - len(winning_text)/2) + winning_text_colour + winning_text)
+        print_text(escapes.move[config.game_height/2 - 1][config.game_width/2 - len(winning_text)/2] + winning_text_colour + winning_text)
+        cursor.forget()
         print_text_flush_buffer()
+        wait_for_output()
+
+# The state tuple made by Game.snapshot holds, in order:
+#   the game's fields: game_state, player_serving, step_count, current_rally, then the stats points, paddle_bounces, wall_bounces, longest_rally and steps
+#   the ball's fields, then each paddle's fields
+# state_layout names every item of the tuple, and of the array made from it by pack_state.
+game_states = ["serving", "playing", "round_ending", "game_ending"]
+player_ids = ["player1", "player2"]
+game_state_size = 9
+paddle1_start = game_state_size + 8 # after the ball's fields
+paddle2_start = paddle1_start + 11
+state_layout = (["game_state", "player_serving", "step_count", "current_rally", "points", "paddle_bounces", "wall_bounces", "longest_rally", "steps"] +
+        ["ball." + name for name in ["prev_x", "prev_y", "x", "y", "vx", "vy", "init_speed", "trajectory"]] +
+        ["paddle1." + name for name in ["prev_x", "prev_y", "x", "y", "vy", "height", "speed", "score", "stretches_left", "stretch_time_left", "is_stretched"]] +
+        ["paddle2." + name for name in ["prev_x", "prev_y", "x", "y", "vy", "height", "speed", "score", "stretches_left", "stretch_time_left", "is_stretched"]])
+
+# prev_x and prev_y are None before an object has moved. They're stored as NaN in the state array.
+NAN = float("nan")
+
+def pack_state(state):
+    """
+    Packs a state tuple from Game.snapshot into an array of doubles, e.g. to checksum it or save it as a single buffer.
+    game_state and player_serving are stored as indexes into game_states and player_ids.
+    """
+    values = list(state)
+    values[0] = game_states.index(values[0])
+    values[1] = player_ids.index(values[1])
+    return array("d", [NAN if value == None else value for value in values])
+
+# The game objects use __slots__, so they don't each carry a dict and looking up their fields in Game.update is a little quicker
+class Ball(object):
+    __slots__ = ["rng", "prev_x", "prev_y", "x", "y", "vx", "vy", "init_speed", "trajectory"]
+    colour = "on_green"
 
-        time.sleep(config.game_over_pause_time)
+    def __init__(self, rng=random):
+        # rng is the random number generator used for the serve direction and bounces. It can be the random module itself or a random.Random object.
+        self.rng = rng
 
-class Ball:
-    def __init__(self):
         # Keep a note of the previous position to help when redrawing
         self.prev_x = None
         self.prev_y = None
@@ -385,7 +794,10 @@ class Ball:
         self.vx = 0 # velocity in x and y directions
         self.vy = 0
         self.init_speed = config.ball_init_speed 
-        self.colour = terminal.on_green
+
+        # This is increased whenever the ball's trajectory changes other than by bouncing off a wall, i.e. when it is reset, served or hits a paddle.
+        # It lets predictor.Predictor know when its cached predictions are out of date.
+        self.trajectory = 0
 
     def reset(self):
         """
@@ -401,25 +813,20 @@ class Ball:
 
         # Choose starting direction randomly.
         # It could be either directly left or directly right
-        rand_direction = random.choice([-1.0, 1.0])
+        rand_direction = self.rng.choice([-1.0, 1.0])
         self.vx = rand_direction * self.init_speed
         self.vy = 0.0
+        self.trajectory += 1
+
+    def snapshot(self):
+        return (self.prev_x, self.prev_y, self.x, self.y, self.vx, self.vy, self.init_speed, self.trajectory)
+
+    def restore(self, snapshot):
+        self.prev_x, self.prev_y, self.x, self.y, self.vx, self.vy, self.init_speed, self.trajectory = snapshot
 
     def draw(self):
         logging.debug("ball: Ball draw")
         draw_square(int(self.x), int(self.y), colour=self.colour)
-    
-    def redraw(self):
-        logging.debug("ball: Ball redraw")
-
-        if int(self.prev_x) == int(self.x) and int(self.prev_y) == int(self.y):
-            logging.debug("Not redrawing ball because it hasn't moved (probably cause player is serving).")
-        else:
-            # First remove the old ball
-            draw_square(int(self.prev_x), int(self.prev_y))
-
-            # Now draw the new one
-            draw_square(int(self.x), int(self.y), colour=self.colour)
 
     def update(self):
         self.prev_x = self.x
@@ -427,7 +834,7 @@ class Ball:
 
         self.x += self.vx
         self.y += self.vy
-        logging.debug("ball: Ball updated. prev_x={0}, prev_y={1}, x={2}, y={3}, vx={4}, vy={5}".format(self.prev_x, self.prev_y, self.x, self.y, self.vx, self.vy))
+        logging.debug("ball: Ball updated. prev_x=%s, prev_y=%s, x=%s, y=%s, vx=%s, vy=%s", self.prev_x, self.prev_y, self.x, self.y, self.vx, self.vy)
 
     def bounce_off_paddle(self, paddle):
         # Reverse the x direction
@@ -439,14 +846,18 @@ class Ball:
         # Randomize x velocity
         # The config value ball_bounce_randomness is used to determine the range of speeds the ball can attain
         r = config.ball_bounce_randomness
-        new_vx = (1.0 - r + random.random() * 2 * r) * self.init_speed
+        new_vx = (1.0 - r + self.rng.random() * 2 * r) * self.init_speed
 
         y_delta = (self.y + 0.5) - (paddle.y + paddle.height/2.0)
 
         self.vx = new_x_direction * new_vx
         self.vy = (2 * y_delta * self.init_speed) / paddle.height
+        self.trajectory += 1
+
+class Paddle(object):
+    __slots__ = ["id", "height", "offset", "speed", "score", "stretches_left", "stretch_time_left", "is_stretched",
+            "prev_x", "prev_y", "y", "x", "vy", "colour"]
 
-class Paddle:
     def __init__(self, id):
         # terminal should be a Blessed-library Terminal object
         # id should be either "player1" or "player2"
@@ -456,7 +867,7 @@ class Paddle:
         self.speed = config.paddle_speed
         self.score = 1 # score in points. 1 goal = 1 point
         self.stretches_left = config.paddle_max_stretches
-        self.stretch_begin_time = None # this is set to the current time when the paddle is stretched
+        self.stretch_time_left = 0.0 # this is set to config.paddle_stretch_duration when the paddle is stretched, and counts down in simulation time
         self.is_stretched = False
 
         self.prev_x = None
@@ -465,9 +876,9 @@ class Paddle:
         self.x = 0
         self.vy = 0.0 # velocity in the y direction
         if self.id == "player1":
-            self.colour = terminal.on_blue
+            self.colour = "on_blue"
         else:
-            self.colour = terminal.on_red
+            self.colour = "on_red"
 
 
     def reset(self):
@@ -490,20 +901,19 @@ class Paddle:
         self.vy = 0
         self.is_stretched = False
 
+    def snapshot(self):
+        return (self.prev_x, self.prev_y, self.x, self.y, self.vy, self.height, self.speed, self.score,
+                self.stretches_left, self.stretch_time_left, self.is_stretched)
+
+    def restore(self, snapshot):
+        (self.prev_x, self.prev_y, self.x, self.y, self.vy, self.height, self.speed, self.score,
+                self.stretches_left, self.stretch_time_left, self.is_stretched) = snapshot
+
     def draw(self):
         # Draw each of the paddle's squares one by one from the top down
         for i in range(0, self.height):
             draw_square(int(self.x), int(self.y + i), colour=self.colour)
 
-    def redraw(self):
-        # Only redraw if the paddle moved
-        if int(self.prev_x) != int(self.x) or int(self.prev_y) != int(self.y):
-            for y in range(0, self.height):
-                draw_square(int(self.prev_x), int(self.prev_y + y))
-
-            for y in range(0, self.height):
-                draw_square(int(self.x), int(self.y + y), colour=self.colour)
-
     def update(self):
         self.prev_x = self.x
         self.prev_y = self.y
@@ -512,7 +922,8 @@ class Paddle:
         self.vy = 0
 
         if self.is_stretched:
-            if (datetime.datetime.now() - self.stretch_begin_time).total_seconds() >= config.paddle_stretch_duration:
+            self.stretch_time_left -= 1 / float(config.game_sim_rate)
+            if self.stretch_time_left <= 0:
                 self.unstretch()
 
     def stretch(self):
@@ -520,57 +931,57 @@ class Paddle:
         Stretches the paddle, extending its height by 2
         """
         if self.stretches_left > 0:
-            logging.info("{0} stretched their paddle".format(self.id))
+            logging.info("%s stretched their paddle", self.id)
             self.is_stretched = True
-            self.stretch_begin_time = datetime.datetime.now()
+            self.stretch_time_left = config.paddle_stretch_duration
             self.stretches_left -= 1
             self.height += 2
             self.y -= 1
         else:
-            logging.info("{0} tried to stretch their paddle but had no stretches left.")
+            logging.info("%s tried to stretch their paddle but had no stretches left.", self.id)
 
     def unstretch(self):
-        # Undraw the stretched paddle
-        for i in range(0, self.height):
-            draw_square(int(self.x), int(self.y + i))
-
         self.is_stretched = False
         self.height = config.paddle_height
         self.y += 1
 
-    def collides_with_ball(self, ball):
+    def hitbox(self):
         """
-        Returns True if the paddle is colliding with the ball, False otherwise.
-        The variables left_x, right_x, top_y, bottom_y below define a rectangle which is the hitbox of the paddle.
+        Returns (left_x, right_x, top_y, bottom_y), the rectangle which is the hitbox of the paddle.
         The hitbox for each paddle extends 1 square in front of it, which makes for more accurate looking collisions.
         """
         top_y = int(self.y)
         bottom_y = top_y + self.height
 
         if self.id == "player1":
-            left_x = self.x
-            right_x = self.x + 2
+            return self.x, self.x + 2, top_y, bottom_y
+        else: # self.id == "player2"
+            return self.x - 1, self.x + 1, top_y, bottom_y
 
-            if (ball.y >= top_y and
-                ball.y <= bottom_y and
-                ball.x >= left_x and
-                ball.x <= right_x and
-                ball.vx < 0):
-                    return True
+    def moving_towards(self, ball):
+        """
+        Returns True if the ball is moving towards this paddle. The ball can only hit a paddle it is moving towards.
+        """
+        if self.id == "player1":
+            return ball.vx < 0
         else: # self.id == "player2"
-            left_x = self.x - 1
-            right_x = self.x + 1
+            return ball.vx > 0
 
-            if (ball.y >= top_y and
+    def collides_with_ball(self, ball):
+        """
+        Returns True if the ball is in the paddle's hitbox and moving towards it, False otherwise.
+        Note this only checks the ball's current position - Game.move_ball checks the ball's whole path.
+        """
+        left_x, right_x, top_y, bottom_y = self.hitbox()
+        return (ball.y >= top_y and
                 ball.y <= bottom_y and
                 ball.x >= left_x and
                 ball.x <= right_x and
-                ball.vx > 0):
-                    return True
+                self.moving_towards(ball))
 
-        return False
+class UserInterface(object):
+    __slots__ = ["ball", "paddle1", "paddle2", "net_positions", "p1_score_positions", "p2_score_positions"]
 
-class UserInterface:
     def __init__(self, ball, paddle1, paddle2):
         # Keep a reference to the ball so we can tell if it passed over the UI or not
         self.ball = ball
@@ -630,35 +1041,18 @@ class UserInterface:
         logging.debug("UI: UI draw")
 
         # Draw net 
+        # These are low priority since they rarely change, so they can be spread over several frames when rendering to a byte budget
         for x,y in self.net_positions:
-            draw_square(x, y, colour=terminal.on_white)
+            draw_square(x, y, colour="on_white", priority=PRIORITY_LOW)
 
         # Draw scores
         # Player 1
         for x,y in self.p1_score_positions:
-            draw_square(x, y, colour=self.paddle1.colour)
+            draw_square(x, y, colour=self.paddle1.colour, priority=PRIORITY_LOW)
 
         # Player 2
         for x,y in self.p2_score_positions:
-            draw_square(x, y, colour=self.paddle2.colour)
-
-
-    def redraw(self):
-        """
-        Detect if the ball passed over a square in the UI and if so then redraw it.
-        """
-        prev_x = int(self.ball.prev_x)
-        prev_y = int(self.ball.prev_y)
-
-        if (prev_x, prev_y) in self.net_positions:
-            logging.debug("Ball passed over net so redrawing the square.")
-            draw_square(prev_x, prev_y, colour=terminal.on_white)
-        elif (prev_x, prev_y) in self.p1_score_positions:
-            logging.debug("Ball passed over p1 score so redrawing the square.")
-            draw_square(prev_x, prev_y, colour=self.paddle1.colour)
-        elif (prev_x, prev_y) in self.p2_score_positions:
-            logging.debug("Ball passed over p2 score so redrawing the square.")
-            draw_square(prev_x, prev_y, colour = self.paddle2.colour)
+            draw_square(x, y, colour=self.paddle2.colour, priority=PRIORITY_LOW)
 
     def update(self):
         logging.debug("UI: UI update")
@@ -0,0 +1,101 @@
+# Logging for the game loop which keeps file writes off the frame path.
+# Records are put into an in-memory ring buffer and written to disk by a background thread.
+# Log calls should pass their arguments separately, e.g. logging.debug("ball: x=%s", x), rather than formatting the message themselves.
+# That way a record at a disabled level is thrown away by the logging module before anything is formatted.
+import collections
+import logging
+import threading
+import time
+
+log_format = "%(levelname)s:%(name)s:%(message)s"
+
+class RingBufferHandler(logging.Handler):
+    """
+    A logging handler which stores records in memory and writes them to a file from a background thread.
+
+    emit only fills in the record's message and appends it to two deques, which is cheap and doesn't block on the disk.
+    The most recent records are always kept, so they can be dumped to a separate file after a crash or at game over.
+    Records which haven't been written yet are also capped at capacity, so if the disk can't keep up the oldest are dropped rather than memory growing forever.
+    """
+    def __init__(self, filename, capacity=10000, flush_interval=0.5):
+        logging.Handler.__init__(self)
+        self.setFormatter(logging.Formatter(log_format))
+        self.filename = filename
+        self.flush_interval = flush_interval
+
+        self.records = collections.deque(maxlen=capacity) # the most recent records, for dumping
+        self.pending = collections.deque(maxlen=capacity) # records not yet written to the file
+        self.records_dropped = 0
+
+        self.write_lock = threading.Lock()
+        self.file = open(filename, "w")
+
+        self.thread = threading.Thread(target=self.worker)
+        # Setting the thread to a daemon means it will end when the main thread ends
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def handle(self, record):
+        # deque.append is thread safe, so the handler's lock which logging.Handler.handle takes isn't needed
+        if self.filter(record):
+            self.emit(record)
+        return record
+
+    def emit(self, record):
+        # The message is built now, as Python 3's logging.handlers.QueueHandler does, so arguments which change before the record is written (e.g. the hardware input dicts) are logged as they were
+        record.msg = record.getMessage()
+        record.args = None
+        if len(self.pending) == self.pending.maxlen:
+            self.records_dropped += 1
+        self.records.append(record)
+        self.pending.append(record)
+
+    def worker(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """
+        Writes every pending record to the file.
+        """
+        with self.write_lock:
+            if self.file == None:
+                return
+            while self.pending:
+                record = self.pending.popleft()
+                self.file.write(self.format(record) + "\n")
+            if self.records_dropped:
+                self.file.write("WARNING:gamelog:Dropped {0} records which couldn't be written in time\n".format(self.records_dropped))
+                self.records_dropped = 0
+            self.file.flush()
+
+    def dump(self, filename):
+        """
+        Writes the most recent records to the given file, e.g. after a crash or at game over.
+        """
+        self.flush()
+        with open(filename, "w") as dump_file:
+            for record in list(self.records):
+                dump_file.write(self.format(record) + "\n")
+
+    def close(self):
+        self.flush()
+        with self.write_lock:
+            if self.file != None:
+                self.file.close()
+                self.file = None
+        logging.Handler.close(self)
+
+def setup(filename, level=logging.INFO, capacity=10000):
+    """
+    Sends all logging to a RingBufferHandler writing to the given file, and returns the handler.
+    level can be a level number or name, e.g. "DEBUG".
+    """
+    handler = RingBufferHandler(filename, capacity)
+    root = logging.getLogger()
+    for old_handler in list(root.handlers):
+        root.removeHandler(old_handler)
+    root.addHandler(handler)
+    root.setLevel(level)
+    return handler
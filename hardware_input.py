@@ -1,90 +1,147 @@
 import smbus
+import threading
 import time
+import adc_filter
+import clock
 import config
 import logging
-import threading
 import RPi.GPIO as GPIO
 
 I2CADDR = 0x21
 bus = smbus.SMBus(1)
 
-last_read_player1_input = {
-        "movement":0, # set by resistor input on adc
-        "stretch":0,  # set by push switch
-        "serve":0     # set by push switch
-        }
-last_read_player2_input = {
-        "movement":0,
-        "stretch":0, 
-        "serve":0    
-        }
+class AdcSnapshot(object):
+    """
+    One reading of both players' movement channels from the adc, and the time it was taken. A channel is None if reading it failed.
+    A new snapshot is made for every reading on the executor thread, and is handed to the event loop which adds it to the filters.
+    """
+    __slots__ = ["player1_movement", "player2_movement", "time"]
 
+    def __init__(self, player1_movement, player2_movement, time):
+        self.player1_movement = player1_movement
+        self.player2_movement = player2_movement
+        self.time = time
 
+# True while a read is queued or running on the executor
+reading = False
 
-def input_reader_worker():
-    """
-    This function will be the target of a thread, and will run in the background to periodically read the adc.
-    It updates the global variables last_read_player{1,2}_input
-    """
-    while True:
-        global last_read_player1_input
-        global last_read_player2_input
+# Each movement channel is filtered before it moves a paddle. See adc_filter.py.
+if config.adc_using_p1_ldr:
+    player1_filter = adc_filter.ChannelFilter(config.adc_ldr_min_val, config.adc_ldr_max_val)
+else:
+    player1_filter = adc_filter.ChannelFilter(config.adc_min_val, config.adc_max_val)
+player2_filter = adc_filter.ChannelFilter(config.adc_min_val, config.adc_max_val)
 
-        # First read movement inputs from adc
-        # First write byte to read from Vin3 - player1 input channel
-        try:
-            bus.write_byte(I2CADDR, 0x80)
-            last_read_player1_input["movement"] = read_from_adc()
-        except IOError:
-            logging.warning("hardware_input: IOError when writing to bus. Setting last_read_player1_input to a default value instead.")
-            last_read_player1_input["movement"] = config.adc_max_val / 2
+# If config.adc_trace_file is set, every reading is also written to it, for running through adc_filter.py later
+trace_file = None
 
-        # Now write to read from Vin4 - player2 input channel
-        try:
-            bus.write_byte(I2CADDR, 0x40)
-            last_read_player2_input["movement"] = read_from_adc()
-        except IOError:
-            logging.warning("hardware_input: IOError when writing to bus. Setting last_read_player2_input to a default value instead.")
-            last_read_player2_input["movement"] = config.adc_max_val / 2
+# Button presses seen by the edge callbacks, which run on RPi.GPIO's own thread.
+# A press stays latched until the game consumes it, so a tap much shorter than a simulation step is never missed.
+button_pins = [config.gpio_pin_p1_stretch, config.gpio_pin_p1_serve, config.gpio_pin_p2_stretch, config.gpio_pin_p2_serve]
+latched_presses = dict((pin, False) for pin in button_pins)
+latch_lock = threading.Lock()
 
-        # Then read switch inputs from GPIO ports
-        try:
-            last_read_player1_input["stretch"] = GPIO.input(config.gpio_pin_p1_stretch)
-            last_read_player1_input["serve"] = GPIO.input(config.gpio_pin_p1_serve)
-        except IOError:
-            logging.warning("hardware_input: Unable to read player1 switch input")
+def on_button_edge(pin):
+    with latch_lock:
+        latched_presses[pin] = True
 
-        try:
-            last_read_player2_input["stretch"] = GPIO.input(config.gpio_pin_p2_stretch)
-            last_read_player2_input["serve"] = GPIO.input(config.gpio_pin_p2_serve)
-        except IOError:
-            logging.warning("hardware_input: Unable to read player2 switch input")
+def consume_press(pin):
+    """
+    Returns 1 if the button on pin has been pressed since the last time this was called for it, otherwise 0.
+    """
+    with latch_lock:
+        pressed = latched_presses[pin]
+        latched_presses[pin] = False
+    return 1 if pressed else 0
 
-        time.sleep(1 / float(config.adc_updates_per_sec))
+def read_adc_channels():
+    """
+    Reads both players' movement channels from the adc. The I2C reads block, so this is run on the event loop's executor rather than on the loop itself.
+    Returns a new AdcSnapshot.
+    """
+    # First write byte to read from Vin3 - player1 input channel
+    try:
+        bus.write_byte(I2CADDR, 0x80)
+        player1_movement = read_from_adc()
+    except (IOError, OSError):
+        logging.warning("hardware_input: Error when reading player1's channel from the bus. Skipping this reading of player1's movement.")
+        player1_movement = None
 
-def setup():
+    # Now write to read from Vin4 - player2 input channel
+    try:
+        bus.write_byte(I2CADDR, 0x40)
+        player2_movement = read_from_adc()
+    except (IOError, OSError):
+        logging.warning("hardware_input: Error when reading player2's channel from the bus. Skipping this reading of player2's movement.")
+        player2_movement = None
+
+    snapshot = AdcSnapshot(player1_movement, player2_movement, clock.now())
+    if trace_file != None:
+        # This is run on the executor, so the file write doesn't hold up the event loop
+        try:
+            trace_file.write("{0:.6f},{1},{2}\n".format(snapshot.time, "" if player1_movement == None else player1_movement, "" if player2_movement == None else player2_movement))
+        except (IOError, OSError):
+            logging.exception("hardware_input: Could not write to the adc trace file")
+    return snapshot
+
+def start_read(loop):
+    # If the last read hasn't finished, e.g. because the bus is slow, this one is skipped rather than queued up behind it
+    global reading
+    if reading:
+        return
+    reading = True
+    loop.run_in_executor(read_adc_channels, callback=publish_snapshot)
+
+def publish_snapshot(snapshot):
+    global reading
+    # The next read can start now, even if this one failed
+    reading = False
+    if snapshot == None:
+        return
+    player1_filter.add(snapshot.time, snapshot.player1_movement)
+    player2_filter.add(snapshot.time, snapshot.player2_movement)
+
+def setup(loop):
     """
-    Starts a background thread which reads from the adc periodically.
-    Also configures neccessary switch GPIO pins.
+    Samples the adc config.adc_updates_per_sec times a second on the given runtime.EventLoop.
+    Also configures neccessary switch GPIO pins, with callbacks on each press.
     """
     GPIO.setmode(GPIO.BCM)
-    for pin in [config.gpio_pin_p1_stretch,
-                config.gpio_pin_p1_serve,
-                config.gpio_pin_p2_stretch,
-                config.gpio_pin_p2_serve]:
+    for pin in button_pins:
         GPIO.setup(pin, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
+        # The switches pull the pin high when pressed
+        GPIO.add_event_detect(pin, GPIO.RISING, callback=on_button_edge, bouncetime=config.gpio_bounce_time)
 
-    input_reader_thread = threading.Thread(target=input_reader_worker)
-    input_reader_thread.setDaemon(True)
-    input_reader_thread.start()
+    global trace_file
+    if config.adc_trace_file != None:
+        trace_file = open(config.adc_trace_file, "w")
+        trace_file.write("time,player1,player2\n")
+
+    loop.call_every(1 / float(config.adc_updates_per_sec), start_read, loop)
 
 def get_player1_input():
-    logging.debug("get_player1_input: returning " + str(last_read_player1_input))
-    return last_read_player1_input
+    """
+    Returns player1's filtered movement between -1 and 1, and whether each button has been pressed since the last call.
+    """
+    player_input = {
+            "movement": player1_filter.value(clock.now()), # set by resistor input on adc
+            "stretch": consume_press(config.gpio_pin_p1_stretch), # set by push switch
+            "serve": consume_press(config.gpio_pin_p1_serve) # set by push switch
+            }
+    logging.debug("get_player1_input: returning %s", player_input)
+    return player_input
 
 def get_player2_input():
-    logging.debug("get_player2_input: returning " + str(last_read_player2_input))
-    return last_read_player2_input
+    """
+    Returns player2's filtered movement between -1 and 1, and whether each button has been pressed since the last call.
+    """
+    player_input = {
+            "movement": player2_filter.value(clock.now()),
+            "stretch": consume_press(config.gpio_pin_p2_stretch),
+            "serve": consume_press(config.gpio_pin_p2_serve)
+            }
+    logging.debug("get_player2_input: returning %s", player_input)
+    return player_input
 
 def read_from_adc():
     try:
@@ -106,8 +163,8 @@ def read_from_adc():
         """
         return ZX
     except IOError:
-        # If there was a glitch, just assume the value read is the max value / 2 (i.e. 2048)
-        return config.adc_max_val / 2
+        # If there was a glitch the reading is skipped. The filter keeps the paddle where it was rather than snapping it to the middle.
+        return None
 
 def debug(player1=True, player2=True):
     GPIO.setmode(GPIO.BCM)
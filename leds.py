@@ -1,8 +1,9 @@
 import RPi.GPIO as GPIO
 import config
+import functools
 import logging
 import time
-import threading
+import runtime
 if config.enable_pyglow:
     from PyGlow import PyGlow
     pyglow = PyGlow(brightness=config.pyglow_default_brightness)
@@ -26,7 +27,10 @@ def test():
 
     flash_pyglow()
     """
-    play_pyglow_effect()
+    loop = runtime.EventLoop()
+    play_pyglow_effect(loop)
+    loop.call_later(1.5, loop.stop)
+    loop.run()
 
 def flash_pyglow():
     global pyglow
@@ -43,7 +47,11 @@ def flash_pyglow():
     pyglow.all(brightness=0)
     time.sleep(0.3)
 
-def pyglow_effect_worker():
+def pyglow_effect(loop):
+    """
+    A task which sweeps a light across the PyGlow and back.
+    The PyGlow is written to over I2C, which blocks, so each write is run on the loop's executor.
+    """
     global pyglow
     groups = [
             [1,7,13],
@@ -59,14 +67,12 @@ def pyglow_effect_worker():
             [1,7,13],
             ]
     for group in groups:
-        pyglow.led(group, brightness=160)
-        time.sleep(0.1)
-        pyglow.led(group, brightness=0)
+        loop.run_in_executor(functools.partial(pyglow.led, group, brightness=160))
+        yield 0.1
+        loop.run_in_executor(functools.partial(pyglow.led, group, brightness=0))
 
-def play_pyglow_effect():
-    worker = threading.Thread(target=pyglow_effect_worker)
-    worker.setDaemon(True)
-    worker.start()
+def play_pyglow_effect(loop):
+    loop.spawn(pyglow_effect(loop))
 
 def follow_ball(ball):
     min_x = config.paddle_offset + 1
@@ -86,7 +92,7 @@ def follow_ball(ball):
 
     GPIO.output(next_led, 1)
     current_led_showing = next_led
-    logging.debug("leds: Ball progress: {0}. Showing led {1}".format(ball_percent_progress, current_led_showing))
+    logging.debug("leds: Ball progress: %s. Showing led %s", ball_percent_progress, current_led_showing)
 
 if __name__ == "__main__":
     setup()
@@ -5,17 +5,25 @@ import logging
 import os
 import config
 import game
+import gamelog
+import replay
+import spectators
 
-# Set up logging configuration. Logs will be sent to the file 'game.log'
-logging.basicConfig(filename="game.log", filemode="w", level=logging.DEBUG)
+# Set up logging configuration. Logs will be sent to the file 'game.log' from a background thread
+log_handler = gamelog.setup("game.log", config.log_level, config.log_ring_capacity)
 
 serialPort = None
+byte_budget = None
 if config.is_running_on_pi() and config.output_down_serial_cable:
     import serial
     serialPort = serial.Serial("/dev/ttyAMA0", config.serial_baud_rate)
     if not serialPort.isOpen():
         serialPort.open()
 
+    if config.serial_budgeted_rendering:
+        # Each byte sent down the cable takes 10 bits: a start bit, 8 data bits and a stop bit
+        byte_budget = config.serial_baud_rate / 10 / config.game_fps
+
 # The force_styling attribute is needed so that escape codes remain intact if the output from the program is piped
 terminal = blessed.Terminal(force_styling=True, stream=serialPort)
 
@@ -26,5 +34,28 @@ if __name__ == "__main__":
             terminal.stream.write(terminal.clear)
 
             logging.info("main: Starting game")
-            game = game.Game(terminal)
-            game.play()
+            if config.spectator_port != None:
+                game.spectator_server = spectators.SpectatorServer(config.spectator_port)
+            game = game.Game(terminal, byte_budget=byte_budget)
+            if config.replay_file != None:
+                game.recorder = replay.Recorder(config.replay_file, game.seed)
+            try:
+                game.play()
+            except:
+                # Keep the records leading up to the crash, since game.log is overwritten on the next run
+                logging.exception("main: Game crashed")
+                log_handler.dump("game_crash.log")
+                raise
+            else:
+                # game.log is overwritten on the next run too, so keep the end of a finished match as well
+                log_handler.dump("game_over.log")
+            finally:
+                if game.recorder != None:
+                    game.recorder.close()
+                if game.telemetry != None:
+                    logging.info("main: Frame telemetry\n%s", game.telemetry.report())
+                log_handler.close()
+
+    # Printed after leaving fullscreen mode so it stays on the terminal
+    if game.telemetry != None:
+        print(game.telemetry.report())
@@ -1,62 +1,7 @@
 import RPi.GPIO as GPIO
-import time
-import datetime
-import threading
 import config
-
-frequencies = {
-	"C3": 130.81,
- 	"C#3": 138.59,
-	"Db3": 138.59,
-	"D3": 146.83,
- 	"D#3": 155.56,
-	"Eb3": 155.56,
-	"E3": 164.81,
-	"F3": 174.61,
- 	"F#3": 185.00,
-	"Gb3": 185.00,
-	"G3": 196.00,
- 	"G#3": 207.65,
-	"Ab3": 207.65,
-	"A3": 220.00,
- 	"A#3": 233.08,
-	"Bb3": 233.08,
-	"B3": 246.94,
-	"C4": 261.63,
- 	"C#4": 277.18,
-	"Db4": 277.18,
-	"D4": 293.66,
- 	"D#4": 311.13,
-	"Eb4": 311.13,
-	"E4": 329.63,
-	"F4": 349.23,
- 	"F#4": 369.99,
-	"Gb4": 369.99,
-	"G4": 392.00,
- 	"G#4": 415.30,
-	"Ab4": 415.30,
-	"A4": 440.00,
- 	"A#4": 466.16,
-	"Bb4": 466.16,
-	"B4": 493.88,
-	"C5": 523.25,
- 	"C#5": 554.37,
-	"Db5": 554.37,
-	"D5": 587.33,
- 	"D#5": 622.25,
-	"Eb5": 622.25,
-	"E5": 659.25,
-	"F5": 698.46,
- 	"F#5": 739.99,
-	"Gb5": 739.99,
-	"G5": 783.99,
- 	"G#5": 830.61,
-	"Ab5": 830.61,
-	"A5": 880.00,
- 	"A#5": 932.33,
-	"Bb5": 932.33,
-	"B5": 987.77
-}
+import notes
+import runtime
 
 TRANSPOSE_AMOUNT = 0
 SPEED = 90.0
@@ -66,88 +11,31 @@ crotchet = 1.0 * (60/SPEED)
 quaver = 0.5 * (60/SPEED)
 semiquaver = 0.25 * (60/SPEED)
 
-PITCH_WORKER_OUTPUT_PERIOD = 0
-PITCH_WORKER_SHOULD_STOP = False
-def pitch_worker():
+def play_song(song):
     """
-    When play song is called, this function will be run in a thread.
-    It constantly outputs a frequency on the music output pin.
-    The global value PITCH_WORKER_OUTPUT_PERIOD can be changed to alter the pitch being output.
+    A task which plays a song on the music pin. A song is a series of tuples (pitchstring, duration)
+    The square wave comes from RPi.GPIO's software PWM, which runs outside of Python, so only the changes between notes need scheduling.
+    Run it on an event loop with loop.spawn(play_song(song)).
     """
     music_pin = config.gpio_pin_music
     GPIO.setmode(GPIO.BCM)
     GPIO.setup(music_pin, GPIO.OUT, initial=0)
+    pwm = GPIO.PWM(music_pin, notes.frequencies["C4"])
+    pwm.start(0)
 
-    global PITCH_WORKER_OUTPUT_PERIOD, PITCH_WORKER_SHOULD_STOP
     try:
-        while True:
-            if PITCH_WORKER_OUTPUT_PERIOD == 0:
-                continue
-            elif PITCH_WORKER_SHOULD_STOP:
-                break
-            else:
-                delay = PITCH_WORKER_OUTPUT_PERIOD / 2.0
-                GPIO.output(music_pin, 1)
-                time.sleep(delay)
-                GPIO.output(music_pin, 0)
-                time.sleep(delay)
+        for note in song:
+            pitchstring = notes.transpose(note[0], TRANSPOSE_AMOUNT)
+            duration = note[1]
+
+            pwm.ChangeFrequency(notes.frequencies[pitchstring])
+            pwm.ChangeDutyCycle(50)
+            yield duration*0.75 # duration is in seconds
+            pwm.ChangeDutyCycle(0)
+            yield duration*0.25
     finally:
-        GPIO.cleanup()
-
-def transpose(pitchstring, semitones):
-    pitch_table = {
-            "C": 0,
-            "C#": 1,
-            "Db": 1,
-            "D": 2,
-            "D#": 3,
-            "Eb": 3,
-            "E": 4,
-            "F": 5,
-            "F#": 6,
-            "Gb": 6,
-            "G": 7,
-            "G#": 8,
-            "Ab": 8,
-            "A": 9,
-            "A#": 10,
-            "Bb": 10,
-            "B": 11
-        }
-    reverse_pitchtable = dict(zip(pitch_table.values(), pitch_table.keys()))
-
-    octave = int(pitchstring[-1])
-    note = pitchstring[:-1]
-    index = pitch_table[note]
-
-    octave += (index+semitones)/12
-    new_index = (index+semitones) % 12
-
-    new_pitchstring = reverse_pitchtable[new_index] + str(octave)
-    return new_pitchstring
-
-def play_song(song):
-    """
-    A song is a series of tuples (pitchstring, duration)
-    """
-    pitch_worker_thread = threading.Thread(target=pitch_worker)
-    pitch_worker_thread.setDaemon(True)
-    pitch_worker_thread.start()
-
-    global PITCH_WORKER_OUTPUT_PERIOD, PITCH_WORKER_SHOULD_STOP
-    PITCH_WORKER_OUTPUT_PERIOD = 0
-    PITCH_WORKER_SHOULD_STOP = False
-
-    for note in song:
-        pitchstring = transpose(note[0], TRANSPOSE_AMOUNT)
-        duration = note[1]
-
-        PITCH_WORKER_OUTPUT_PERIOD = 1.0/frequencies[pitchstring]
-        time.sleep(duration*0.75) # duration is in seconds
-        PITCH_WORKER_OUTPUT_PERIOD = 0.0
-        time.sleep(duration*0.25)
-
-    PITCH_WORKER_SHOULD_STOP = True
+        pwm.stop()
+        GPIO.cleanup(music_pin)
 
 scale = [
         ("C3", quaver),
@@ -327,14 +215,15 @@ ohwhenthesaints = [
         ("C4", minim * 2)
         ]
 
-def start_theme_music():
-    global theme_music_thread
-    theme_music_thread = threading.Thread(target=play_song, args=(rickroll,))
-    theme_music_thread.setDaemon(True)
-    theme_music_thread.start()
+theme_music_task = None
+
+def start_theme_music(loop):
+    global theme_music_task
+    theme_music_task = loop.spawn(play_song(rickroll))
 
 def stop_theme_music():
-    SHOULD_STOP_MUSIC = True
+    if theme_music_task != None:
+        theme_music_task.cancel()
 
 if __name__ == "__main__":
     print("minim: " + str(minim))
@@ -342,4 +231,10 @@ if __name__ == "__main__":
     print("quaver: " + str(quaver))
     print("semiquaver: " + str(semiquaver))
 
-    play_song(rickroll)
+    loop = runtime.EventLoop()
+    def play_then_stop():
+        for delay in play_song(rickroll):
+            yield delay
+        loop.stop()
+    loop.spawn(play_then_stop())
+    loop.run()
@@ -0,0 +1,493 @@
+# Two player networked play over UDP, with no server. Each machine controls one paddle and only the players' inputs are sent between them.
+# Both machines run the same simulation from the same seed, stepping it with the same inputs, so they see the same match.
+#
+# Input delay: a local input is used config.net_input_delay steps after it's read, which gives it time to reach the other machine before it's needed.
+# Rollback: if the other player's input for a step still hasn't arrived, it's guessed to be the same as their last one and the game carries on.
+# When the real input arrives and the guess was wrong, the game is restored to its snapshot from that step and simulated forwards again with the right inputs.
+# If the other machine falls more than config.net_max_rollback steps behind, the game waits for it.
+#
+# Usage:
+#   python netplay.py host                        wait for another player on config.net_port, and play as player1
+#   python netplay.py join 192.168.1.20           join a host, and play as player2
+#   python netplay.py proxy 9000 localhost:7777 --loss 0.1 --latency 0.05
+#                                                 relay packets between a joiner and a host, dropping and delaying some, for testing
+# host and join take --ai <difficulty> to have a computer player control the local paddle, and --headless to play without drawing anything.
+# Two headless AI players on one machine are a quick test that the two simulations stay in step, e.g.
+#   python netplay.py host --ai hard --headless &
+#   python netplay.py proxy 9000 localhost:7777 --loss 0.2 --latency 0.03 &
+#   python netplay.py join localhost --port 9000 --ai easy --headless
+import argparse
+import heapq
+import logging
+import random
+import select
+import socket
+import struct
+import time
+import zlib
+import blessed
+import clock
+import config
+import game
+import players
+import runtime
+
+HELLO = 1 # sent by the joiner until the host answers
+WELCOME = 2 # the host's answer, carrying the seed
+INPUTS = 3 # inputs for a range of steps
+
+packet_type_struct = struct.Struct("<B")
+welcome_struct = struct.Struct("<BQ")
+# type, ack (the first step of the receiver's inputs the sender hasn't got yet), checksum step, checksum, first step, number of inputs
+inputs_header_struct = struct.Struct("<BIIIIB")
+input_struct = struct.Struct("<dB")
+
+# Bits in the flags byte of each input
+SERVE = 1
+STRETCH = 2
+
+# The most inputs sent in one packet
+max_inputs_per_packet = 32
+
+# Used as the checksum step when there's no checksum in a packet
+NO_CHECKSUM = 0xffffffff
+
+neutral_input = (0.0, False, False)
+
+def to_input(player_input):
+    """
+    Converts an input dict from an input source into a (vy, serve, stretch) tuple, which can be compared and sent.
+    """
+    return (float(player_input["vy"]), bool(player_input["serve"]), bool(player_input["stretch"]))
+
+def state_checksum(snapshot):
+    state = game.pack_state(snapshot[0])
+    data = state.tobytes() if hasattr(state, "tobytes") else state.tostring()
+    return zlib.crc32(data) & 0xffffffff
+
+class NetInput:
+    """
+    Gives the game the input the session has chosen for one of the players for the step being simulated.
+    """
+    def __init__(self, session, index):
+        self.session = session
+        self.index = index
+
+    def __call__(self, game, paddle):
+        vy, serve, stretch = self.session.step_inputs[self.index]
+        return {"vy": vy, "serve": serve, "stretch": stretch}
+
+class NetSession:
+    """
+    Runs one side of a networked match. sock must already be connected to the other machine's address.
+    local_index is 0 if this machine controls player1 and 1 for player2. local_source is the input source for the local paddle.
+    The host gives the seed as well, so it can answer the joiner's HELLOs until the joiner's first inputs show it got a WELCOME.
+    """
+    def __init__(self, g, sock, local_index, local_source, input_delay=None, max_rollback=None, seed=None):
+        self.game = g
+        self.sock = sock
+        self.local_index = local_index
+        self.remote_index = 1 - local_index
+        self.local_source = local_source
+        self.local_paddle = [g.paddle1, g.paddle2][local_index]
+        self.input_delay = config.net_input_delay if input_delay == None else input_delay
+        self.max_rollback = config.net_max_rollback if max_rollback == None else max_rollback
+        self.welcome = None if seed == None else welcome_struct.pack(WELCOME, seed) # sent in answer to HELLOs, until the other machine's inputs arrive
+
+        g.input_sources = [NetInput(self, 0), NetInput(self, 1)]
+        self.step_inputs = [neutral_input, neutral_input]
+
+        self.frame = 0 # the next step to simulate
+
+        # Inputs for the first few steps can't have been read yet because of the input delay, so both machines use neutral inputs for them
+        self.local_inputs = dict((f, neutral_input) for f in range(self.input_delay))
+        self.remote_inputs = {}
+        self.remote_next = 0 # the first step the other machine's input hasn't arrived for
+        self.peer_ack = 0 # the first step of our inputs the other machine hasn't got
+
+        self.predicted = {} # guesses made for the other machine's input, by step
+        self.snapshots = {} # the game's state before each step which might need to be simulated again
+        self.rollback_to = None # the earliest step which was simulated with a wrong guess
+        self.win_frame = None # the step at which the game was over, if it is
+
+        # Checksums of the state before confirmed steps, to spot the two simulations drifting apart
+        self.checksums = {}
+        self.peer_checksums = {}
+
+        self.rollbacks = 0
+        self.steps_resimulated = 0
+        self.stalls = 0
+        self.desyncs = 0
+
+    def remote_input(self, f):
+        """
+        Returns the other machine's input for step f, or a guess if it hasn't arrived: the last input received, without any serve or stretch press.
+        """
+        if f in self.remote_inputs:
+            return self.remote_inputs[f]
+
+        if self.remote_next > 0:
+            guess = (self.remote_inputs[self.remote_next - 1][0], False, False)
+        else:
+            guess = neutral_input
+        self.predicted[f] = guess
+        return guess
+
+    def simulate(self, f):
+        """
+        Simulates step f, saving a snapshot beforehand so it can be simulated again if a guess turns out wrong.
+        """
+        g = self.game
+        self.snapshots[f] = g.snapshot()
+
+        inputs = [None, None]
+        inputs[self.local_index] = self.local_inputs.get(f, neutral_input)
+        inputs[self.remote_index] = self.remote_input(f)
+        self.step_inputs = inputs
+
+        # A new round starts on the step after a point is scored. Once someone has won, the game stays as it is.
+        if g.game_state == "round_ending":
+            if g.winner() != None:
+                if self.win_frame == None or f < self.win_frame:
+                    self.win_frame = f
+                return
+            g.reset_round()
+
+        g.handle_input()
+        g.update()
+
+    def tick(self):
+        """
+        Runs one step of the match: receives the other machine's inputs, rolls back if needed, reads the local input and simulates the next step.
+        Returns False if the step had to wait for the other machine.
+        """
+        self.receive()
+
+        if self.rollback_to != None:
+            rollback_to = self.rollback_to
+            self.rollback_to = None
+            if rollback_to < self.frame:
+                logging.info("netplay: Rolling back %s steps to step %s", self.frame - rollback_to, rollback_to)
+                self.rollbacks += 1
+                self.steps_resimulated += self.frame - rollback_to
+                self.game.restore(self.snapshots[rollback_to])
+                if self.win_frame != None and self.win_frame >= rollback_to:
+                    self.win_frame = None
+                for f in range(rollback_to, self.frame):
+                    self.simulate(f)
+
+        if self.frame - self.remote_next >= self.max_rollback:
+            # Going any further would mean keeping more snapshots than max_rollback, so wait for the other machine to catch up
+            self.stalls += 1
+            self.send()
+            return False
+
+        player_input = self.local_source(self.game, self.local_paddle)
+        self.local_inputs[self.frame + self.input_delay] = to_input(player_input)
+
+        self.simulate(self.frame)
+        self.frame += 1
+        self.send()
+        self.forget_old_steps()
+        return True
+
+    def finished(self):
+        """
+        Returns True once someone has won and every input up to the step the game ended has arrived, so the result can't be rolled back.
+        """
+        return self.win_frame != None and self.remote_next >= self.win_frame and self.rollback_to == None
+
+    def receive(self):
+        while True:
+            try:
+                data = self.sock.recv(4096)
+            except socket.error:
+                return # nothing left to read
+            if len(data) < packet_type_struct.size:
+                continue
+
+            packet_type = packet_type_struct.unpack_from(data)[0]
+            if packet_type == INPUTS and len(data) >= inputs_header_struct.size:
+                # The other machine only sends inputs once it has the WELCOME, so there's no need to answer its HELLOs any more
+                self.welcome = None
+                self.receive_inputs(data)
+            elif packet_type == HELLO and self.welcome != None:
+                # The last WELCOME was lost, so the joiner is still waiting for one
+                try:
+                    self.sock.send(self.welcome)
+                except socket.error:
+                    pass
+
+    def receive_inputs(self, data):
+        packet_type, ack, checksum_frame, checksum, start, count = inputs_header_struct.unpack_from(data)
+        self.peer_ack = max(self.peer_ack, ack)
+        if checksum_frame != NO_CHECKSUM:
+            self.peer_checksums[checksum_frame] = checksum
+
+        for i in range(count):
+            offset = inputs_header_struct.size + i * input_struct.size
+            if offset + input_struct.size > len(data):
+                break
+            vy, flags = input_struct.unpack_from(data, offset)
+            f = start + i
+            if f < self.remote_next or f in self.remote_inputs:
+                continue
+
+            player_input = (vy, flags & SERVE != 0, flags & STRETCH != 0)
+            self.remote_inputs[f] = player_input
+            guess = self.predicted.pop(f, None)
+            if guess != None and guess != player_input:
+                if self.rollback_to == None or f < self.rollback_to:
+                    self.rollback_to = f
+
+        while self.remote_next in self.remote_inputs:
+            self.remote_next += 1
+
+    def send(self):
+        start = self.peer_ack
+        end = min(self.frame + self.input_delay, start + max_inputs_per_packet)
+
+        # The state before remote_next only depends on inputs which have all arrived, so it's the same on both machines
+        checksum_frame = NO_CHECKSUM
+        checksum = 0
+        if self.confirmed(self.remote_next):
+            checksum_frame = self.remote_next
+            checksum = self.checksum(checksum_frame)
+        self.compare_checksums()
+
+        parts = [inputs_header_struct.pack(INPUTS, self.remote_next, checksum_frame, checksum, start, max(0, end - start))]
+        for f in range(start, end):
+            vy, serve, stretch = self.local_inputs[f]
+            parts.append(input_struct.pack(vy, (SERVE if serve else 0) | (STRETCH if stretch else 0)))
+        try:
+            self.sock.send(b"".join(parts))
+        except socket.error:
+            # e.g. the other machine isn't listening yet. The inputs are sent again with the next packet.
+            pass
+
+    def confirmed(self, f):
+        """
+        Returns True if the state before step f only depends on inputs which have all arrived, so it must be the same on both machines, and there's a snapshot of it.
+        """
+        return f <= self.remote_next and self.rollback_to == None and f in self.snapshots
+
+    def checksum(self, f):
+        checksum = self.checksums.get(f)
+        if checksum == None:
+            checksum = state_checksum(self.snapshots[f])
+            self.checksums[f] = checksum
+        return checksum
+
+    def compare_checksums(self):
+        oldest = min(self.remote_next, self.frame) - 1
+        for f in list(self.peer_checksums.keys()):
+            if self.confirmed(f):
+                if self.checksum(f) != self.peer_checksums[f]:
+                    self.desyncs += 1
+                    logging.warning("netplay: The game on the other machine was different before step %s", f)
+                del self.peer_checksums[f]
+            elif f < oldest:
+                # The snapshot has been thrown away so it can't be checked
+                del self.peer_checksums[f]
+
+    def forget_old_steps(self):
+        """
+        Throws away snapshots, inputs and checksums which can't be needed any more.
+        """
+        oldest = min(self.remote_next, self.frame) - 1
+        for f in [f for f in self.snapshots if f < oldest]:
+            del self.snapshots[f]
+        # Local inputs are kept until the other machine has them and no step using them can be simulated again
+        for f in [f for f in self.local_inputs if f < min(self.peer_ack, oldest)]:
+            del self.local_inputs[f]
+        # The other machine's inputs can arrive before the steps they're for, so they're only thrown away once simulated.
+        # The last one which has arrived in order is kept for guessing the next.
+        for f in [f for f in self.remote_inputs if f < min(self.remote_next - 1, oldest)]:
+            del self.remote_inputs[f]
+        for f in [f for f in self.predicted if f < self.remote_next]:
+            del self.predicted[f]
+        for f in [f for f in self.checksums if f < oldest - self.max_rollback]:
+            del self.checksums[f]
+
+    def run(self):
+        """
+        Plays the match in real time until someone wins. Returns the id of the winner.
+        """
+        g = self.game
+        g.reset_round()
+        if not g.headless:
+            g.draw()
+
+        # Headless games don't come with an event loop, so one is made here
+        loop = g.loop if g.loop != None else runtime.EventLoop()
+        if g.keyboard != None:
+            g.keyboard.start(loop)
+
+        def step():
+            if self.finished():
+                loop.stop()
+                return
+            self.tick()
+            if not g.headless:
+                g.redraw()
+            if g.keyboard != None:
+                g.keyboard.end_frame()
+
+        def linger():
+            self.receive()
+            self.send()
+
+        # If a step runs late the timer skips ahead rather than trying to catch up
+        step_time = 1 / float(config.game_sim_rate)
+        timer = loop.call_every(step_time, step)
+        try:
+            loop.run()
+        finally:
+            timer.cancel()
+            if g.keyboard != None:
+                g.keyboard.stop()
+
+        # Keep sending for a moment, in case the other machine is still waiting for our last inputs
+        timer = loop.call_every(step_time, linger)
+        loop.call_later(1.0, loop.stop)
+        loop.run()
+        timer.cancel()
+
+        return g.winner()
+
+def host(port):
+    """
+    Waits for another machine to join. Returns a socket connected to it and the seed for the match.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("", port))
+    logging.info("netplay: Waiting for another player on port %s", port)
+    seed = random.SystemRandom().randrange(2**63)
+    while True:
+        data, address = sock.recvfrom(4096)
+        if len(data) >= packet_type_struct.size and packet_type_struct.unpack_from(data)[0] == HELLO:
+            break
+
+    sock.connect(address)
+    # If this is lost the joiner keeps sending HELLOs, which NetSession answers with another WELCOME
+    sock.send(welcome_struct.pack(WELCOME, seed))
+    sock.setblocking(False)
+    return sock, seed
+
+def join(address, timeout=30.0):
+    """
+    Joins the host at the given (host, port) address. Returns a connected socket and the seed for the match.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.connect(address)
+    end_time = clock.now() + timeout
+    while clock.now() < end_time:
+        try:
+            sock.send(packet_type_struct.pack(HELLO))
+        except socket.error:
+            pass # the host isn't listening yet
+        ready, _, _ = select.select([sock], [], [], 0.25)
+        if ready:
+            try:
+                data = sock.recv(4096)
+            except socket.error:
+                continue
+            if len(data) == welcome_struct.size and packet_type_struct.unpack_from(data)[0] == WELCOME:
+                sock.setblocking(False)
+                return sock, welcome_struct.unpack(data)[1]
+    raise RuntimeError("Could not join {0}:{1}".format(address[0], address[1]))
+
+def run_proxy(listen_port, target, loss=0.0, latency=0.0, jitter=0.0, seed=None):
+    """
+    Relays UDP packets between a joiner, which sends to listen_port, and a host at the target (host, port) address.
+    Each packet is dropped with probability loss, and otherwise delayed by latency plus up to jitter seconds, in both directions.
+    """
+    rng = random.Random(seed)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("", listen_port))
+    target = (socket.gethostbyname(target[0]), target[1])
+    client = None
+    queue = [] # (send time, order, data, address), as a heap
+    order = 0
+    while True:
+        timeout = max(0.0, queue[0][0] - clock.now()) if queue else 1.0
+        ready, _, _ = select.select([sock], [], [], timeout)
+        if ready:
+            data, address = sock.recvfrom(4096)
+            if address == target:
+                destination = client
+            else:
+                client = address
+                destination = target
+            if destination != None and rng.random() >= loss:
+                heapq.heappush(queue, (clock.now() + latency + rng.random() * jitter, order, data, destination))
+                order += 1
+
+        while queue and queue[0][0] <= clock.now():
+            send_time, _, data, destination = heapq.heappop(queue)
+            sock.sendto(data, destination)
+
+def make_local_source(g, local_index, ai):
+    if ai != None:
+        return players.AIPlayer(ai)
+    # The local player uses player1's keys whichever paddle they control
+    g.keyboard = players.Keyboard(game.terminal)
+    return players.KeyboardInput(g.keyboard, up="w", down="s", serve="e", stretch="r")
+
+def play(sock, seed, local_index, ai=None, headless=False):
+    # Only the host answers HELLOs
+    session_seed = seed if local_index == 0 else None
+    if headless:
+        g = game.Game(None, input_sources=[], seed=seed)
+        session = NetSession(g, sock, local_index, make_local_source(g, local_index, ai), seed=session_seed)
+        winner = session.run()
+    else:
+        terminal = blessed.Terminal(force_styling=True)
+        with terminal.fullscreen():
+            with terminal.hidden_cursor():
+                terminal.stream.write(terminal.clear)
+                g = game.Game(terminal, input_sources=[], seed=seed)
+                session = NetSession(g, sock, local_index, make_local_source(g, local_index, ai), seed=session_seed)
+                winner = session.run()
+                g.game_over(winner)
+                time.sleep(config.game_over_pause_time)
+
+    print("Winner: {0}, score: {1}-{2}, steps: {3}".format(winner, g.paddle1.score, g.paddle2.score, session.frame))
+    print("Rollbacks: {0}, steps simulated again: {1}, waits for the other player: {2}, desyncs: {3}".format(
+            session.rollbacks, session.steps_resimulated, session.stalls, session.desyncs))
+    print("Final state checksum: {0:08x}".format(state_checksum(g.snapshot())))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Play pong against another machine over UDP.")
+    subparsers = parser.add_subparsers(dest="command")
+
+    host_parser = subparsers.add_parser("host", help="wait for another player to join, and play as player1")
+    host_parser.add_argument("--port", type=int, default=config.net_port)
+    join_parser = subparsers.add_parser("join", help="join a host, and play as player2")
+    join_parser.add_argument("host")
+    join_parser.add_argument("--port", type=int, default=config.net_port)
+    for p in [host_parser, join_parser]:
+        p.add_argument("--ai", choices=sorted(players.ai_difficulties.keys()), help="have a computer player control the local paddle")
+        p.add_argument("--headless", action="store_true", help="play without drawing anything")
+
+    proxy_parser = subparsers.add_parser("proxy", help="relay packets between a joiner and a host, dropping and delaying some")
+    proxy_parser.add_argument("listen_port", type=int)
+    proxy_parser.add_argument("target", help="the host's address, as host:port")
+    proxy_parser.add_argument("--loss", type=float, default=0.0, help="chance of dropping each packet")
+    proxy_parser.add_argument("--latency", type=float, default=0.0, help="seconds to delay each packet by")
+    proxy_parser.add_argument("--jitter", type=float, default=0.0, help="up to this many extra seconds of random delay")
+    proxy_parser.add_argument("--seed", type=int, default=None, help="seed for choosing which packets to drop")
+    args = parser.parse_args()
+
+    # Each command logs to its own file, so a host and a joiner on the same machine don't write over each other
+    logging.basicConfig(filename="netplay_{0}.log".format(args.command), filemode="w", level=logging.INFO)
+
+    if args.command == "proxy":
+        target_host, _, target_port = args.target.rpartition(":")
+        run_proxy(args.listen_port, (target_host, int(target_port)), args.loss, args.latency, args.jitter, args.seed)
+    elif args.command == "host":
+        sock, seed = host(args.port)
+        play(sock, seed, 0, args.ai, args.headless)
+    else:
+        sock, seed = join((args.host, args.port))
+        play(sock, seed, 1, args.ai, args.headless)
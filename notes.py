@@ -0,0 +1,87 @@
+# Note names and their frequencies, and transposing between them. music.py plays them on the Pi; they're kept apart from it as they don't need RPi.GPIO.
+
+frequencies = {
+	"C3": 130.81,
+ 	"C#3": 138.59,
+	"Db3": 138.59,
+	"D3": 146.83,
+ 	"D#3": 155.56,
+	"Eb3": 155.56,
+	"E3": 164.81,
+	"F3": 174.61,
+ 	"F#3": 185.00,
+	"Gb3": 185.00,
+	"G3": 196.00,
+ 	"G#3": 207.65,
+	"Ab3": 207.65,
+	"A3": 220.00,
+ 	"A#3": 233.08,
+	"Bb3": 233.08,
+	"B3": 246.94,
+	"C4": 261.63,
+ 	"C#4": 277.18,
+	"Db4": 277.18,
+	"D4": 293.66,
+ 	"D#4": 311.13,
+	"Eb4": 311.13,
+	"E4": 329.63,
+	"F4": 349.23,
+ 	"F#4": 369.99,
+	"Gb4": 369.99,
+	"G4": 392.00,
+ 	"G#4": 415.30,
+	"Ab4": 415.30,
+	"A4": 440.00,
+ 	"A#4": 466.16,
+	"Bb4": 466.16,
+	"B4": 493.88,
+	"C5": 523.25,
+ 	"C#5": 554.37,
+	"Db5": 554.37,
+	"D5": 587.33,
+ 	"D#5": 622.25,
+	"Eb5": 622.25,
+	"E5": 659.25,
+	"F5": 698.46,
+ 	"F#5": 739.99,
+	"Gb5": 739.99,
+	"G5": 783.99,
+ 	"G#5": 830.61,
+	"Ab5": 830.61,
+	"A5": 880.00,
+ 	"A#5": 932.33,
+	"Bb5": 932.33,
+	"B5": 987.77
+}
+
+def transpose(pitchstring, semitones):
+    pitch_table = {
+            "C": 0,
+            "C#": 1,
+            "Db": 1,
+            "D": 2,
+            "D#": 3,
+            "Eb": 3,
+            "E": 4,
+            "F": 5,
+            "F#": 6,
+            "Gb": 6,
+            "G": 7,
+            "G#": 8,
+            "Ab": 8,
+            "A": 9,
+            "A#": 10,
+            "Bb": 10,
+            "B": 11
+        }
+    reverse_pitchtable = dict(zip(pitch_table.values(), pitch_table.keys()))
+
+    octave = int(pitchstring[-1])
+    note = pitchstring[:-1]
+    index = pitch_table[note]
+
+    octave += (index+semitones)/12
+    new_index = (index+semitones) % 12
+
+    new_pitchstring = reverse_pitchtable[new_index] + str(octave)
+    return new_pitchstring
@@ -0,0 +1,128 @@
+import logging
+import threading
+import time
+import runtime
+
+class OutputWriter:
+    """
+    Writes finished frames to a stream on an executor thread, so the game loop never blocks on a slow stream such as the serial port.
+
+    Frames are handed over through a single slot mailbox. The writer always sends the newest frame in the slot.
+    If a new frame is submitted before the writer has taken the last one, the old frame is dropped rather than queued.
+    Frames built by the renderer only contain the squares which changed, so dropping one would lose those changes.
+    To avoid that, the game checks ready() before building a frame and skips rendering while the writer is behind. The squares stay dirty in the renderer and go out with the next frame.
+
+    Each frame is written by its own call on the executor, so other blocking hardware calls sharing the executor (e.g. reading the adc) get their turn between frames.
+    If no executor is given the writer makes its own.
+    """
+    def __init__(self, stream, executor=None):
+        self.stream = stream
+        if executor == None:
+            executor = runtime.Executor()
+        self.executor = executor
+        self.condition = threading.Condition()
+        self.pending_frame = None # the single slot mailbox
+        self.writing = False # True while a write is queued or running on the executor
+
+        self.frames_written = 0
+        self.frames_dropped = 0
+        self.bytes_written = 0
+
+    def submit(self, frame):
+        """
+        Puts a frame of bytes into the mailbox, replacing any frame which hasn't been taken yet. Never blocks on the stream.
+        """
+        with self.condition:
+            if self.pending_frame != None:
+                self.frames_dropped += 1
+                logging.debug("output_writer: Dropped a stale frame")
+            self.pending_frame = frame
+            if not self.writing:
+                self.writing = True
+                self.executor.submit(self.write_pending)
+
+    def ready(self):
+        """
+        Returns True if there's no frame waiting in the mailbox, i.e. the next frame submitted won't replace one.
+        """
+        return self.pending_frame == None
+
+    def wait_until_idle(self, timeout=None):
+        """
+        Blocks until every submitted frame has been written. Returns False if the timeout ran out first.
+        """
+        end_time = None if timeout == None else time.time() + timeout
+        with self.condition:
+            while self.pending_frame != None or self.writing:
+                remaining = None if end_time == None else end_time - time.time()
+                if remaining != None and remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+    def write_pending(self):
+        """
+        Run on the executor. Writes the frame in the mailbox, then queues another write if a new frame arrived meanwhile.
+        """
+        with self.condition:
+            frame = self.pending_frame
+            self.pending_frame = None
+
+        try:
+            self.stream.write(frame)
+            self.stream.flush()
+        except Exception:
+            logging.exception("output_writer: Could not write frame to stream!")
+
+        with self.condition:
+            self.frames_written += 1
+            self.bytes_written += len(frame)
+            if self.pending_frame != None:
+                self.executor.submit(self.write_pending)
+            else:
+                self.writing = False
+            self.condition.notify_all()
+
+class ThrottledStream:
+    """
+    Wraps a stream and slows writes down to a given baud rate.
+    This can stand in for the serial port when testing the output writer on a PC, e.g. by wrapping a pty or a pipe.
+    """
+    def __init__(self, stream, baud_rate):
+        self.stream = stream
+        # Each byte sent down a serial line takes 10 bits: a start bit, 8 data bits and a stop bit
+        self.seconds_per_byte = 10.0 / baud_rate
+
+    def write(self, data):
+        self.stream.write(data)
+        time.sleep(len(data) * self.seconds_per_byte)
+
+    def flush(self):
+        self.stream.flush()
+
+if __name__ == "__main__":
+    # Writes frames much faster than a throttled pty can take them, to check stale frames get dropped and submit never blocks
+    import os
+    master, slave = os.openpty()
+    slave_file = os.fdopen(slave, "wb")
+    writer = OutputWriter(ThrottledStream(slave_file, 115200))
+
+    def drain_pty():
+        try:
+            while True:
+                os.read(master, 4096)
+        except OSError:
+            pass # the pty was closed
+    reader = threading.Thread(target=drain_pty)
+    reader.setDaemon(True)
+    reader.start()
+
+    longest_submit = 0.0
+    for i in range(200):
+        start_time = time.time()
+        writer.submit(b"x" * 1000)
+        longest_submit = max(longest_submit, time.time() - start_time)
+        time.sleep(1 / 32.0)
+
+    writer.wait_until_idle()
+    print("frames written: {0}, frames dropped: {1}, longest submit: {2:.6f}s".format(writer.frames_written, writer.frames_dropped, longest_submit))
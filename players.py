@@ -0,0 +1,251 @@
+# Input sources control a paddle. Each one is called once per simulation step with (game, paddle) and returns a dict like
+# {"vy": paddle velocity, "serve": True/False, "stretch": True/False}, which Game.apply_player_input then applies.
+# Input sources which keep state between steps are classes with a __call__ method. Plain functions can be used too, e.g. simulate.track_ball.
+import collections
+import logging
+import random
+import clock
+import config
+
+if config.is_running_on_pi():
+    import hardware_input
+
+class Keyboard:
+    """
+    Reads keys on the game's event loop as soon as the terminal has input waiting. It is shared by the KeyboardInput of each player.
+
+    Every key read is kept, with the time it arrived, until the next simulation step uses it, so keys pressed by both players in the same step aren't lost.
+    The terminal only sends key presses, not releases, so whether a key is held has to be worked out from the auto-repeats the terminal sends while it's down.
+    A first press only counts as held for config.keyboard_tap_time, so a tap moves the paddle a short way and it can be positioned finely.
+    A press within config.keyboard_repeat_delay of the last one is taken as an auto-repeat, which confirms the key is being held.
+    From then on it counts as held until config.keyboard_release_time passes without another repeat, so the paddle moves every step whatever the repeat rate is.
+
+    If latency is set to a telemetry.RollingMetric, the time from each key arriving to the end of the frame which first used it is recorded into it.
+    """
+    def __init__(self, terminal):
+        self.terminal = terminal
+        self.loop = None
+        self.cbreak = None
+        self.latency = None
+
+        # (key, arrival time) for every key which has been read but not used by a step yet, oldest first
+        self.events = collections.deque()
+
+        # For each key: when its current hold started, when it was last pressed, and whether it has auto-repeated since the hold started
+        self.hold_started = {}
+        self.last_pressed = {}
+        self.repeating = {}
+
+        # The keys pressed since the last step and the time of the current step, so both players see the same keys
+        self.current_step = None
+        self.current_time = None
+        self.pressed = set()
+
+        # Arrival times of the keys used since the last frame was drawn
+        self.frame_key_times = []
+
+    def start(self, loop):
+        """
+        Puts the terminal into cbreak mode, so keys arrive as soon as they're pressed, and starts reading them on the loop.
+        """
+        if self.terminal._keyboard_fd == None:
+            logging.warning("keyboard: The terminal has no keyboard attached, so no keys will be read")
+            return
+        self.loop = loop
+        self.cbreak = self.terminal.cbreak()
+        self.cbreak.__enter__()
+        loop.add_reader(self.terminal._keyboard_fd, self.read_keys)
+
+    def stop(self):
+        if self.loop != None:
+            self.loop.remove_reader(self.terminal._keyboard_fd)
+            self.cbreak.__exit__(None, None, None)
+            self.loop = None
+
+    def read_keys(self):
+        # inkey keeps any bytes it read past the first key, which select doesn't know about, so keep reading until it has nothing left.
+        # A short esc_delay stops a lone escape key holding up the loop while inkey waits to see if a longer sequence follows.
+        now = clock.now()
+        key = self.terminal.inkey(timeout=0, esc_delay=0.01)
+        while key:
+            logging.debug("keyboard: got key: %r, name: %s, code: %s", str(key), key.name, key.code)
+            if key.name != None:
+                # Special keys e.g. left right etc. have a descriptive name like 'KEY_LEFT' # Normal keys like a,b,c don't have a key.name attribute
+                self.events.append((key.name, now))
+            else:
+                self.events.append((str(key), now))
+            key = self.terminal.inkey(timeout=0, esc_delay=0.01)
+
+    def begin_step(self, step):
+        """
+        Uses up every key read since the last step. Calling it again for the same step does nothing.
+        """
+        if step == self.current_step:
+            return
+        self.current_step = step
+        self.current_time = clock.now()
+        self.pressed = set()
+        while self.events:
+            key, arrival_time = self.events.popleft()
+            self.pressed.add(key)
+            last_pressed = self.last_pressed.get(key)
+            if last_pressed != None and arrival_time - last_pressed <= config.keyboard_repeat_delay:
+                # An auto-repeat, so the key is being held and its hold carries on
+                self.repeating[key] = True
+            else:
+                self.hold_started[key] = arrival_time
+                self.repeating[key] = False
+            self.last_pressed[key] = arrival_time
+            self.frame_key_times.append(arrival_time)
+
+    def was_pressed(self, key):
+        """
+        Returns True if key was pressed since the last step.
+        """
+        return key in self.pressed
+
+    def held_since(self, key, now=None):
+        """
+        Returns when key started being held if it's still held down at the current step (or at time now), or None if it isn't.
+        """
+        if now == None:
+            now = self.current_time
+        last_pressed = self.last_pressed.get(key)
+        if last_pressed == None:
+            return None
+        hold_time = config.keyboard_release_time if self.repeating[key] else config.keyboard_tap_time
+        if now - last_pressed > hold_time:
+            return None
+        return self.hold_started[key]
+
+    def end_frame(self):
+        """
+        Should be called once a frame has been drawn, to record the latency of the keys it used.
+        """
+        if self.frame_key_times:
+            if self.latency != None:
+                now = clock.now()
+                for arrival_time in self.frame_key_times:
+                    self.latency.add(now - arrival_time)
+            self.frame_key_times = []
+
+class KeyboardInput:
+    """
+    Controls a paddle with the keyboard. The paddle moves at full speed while the up or down key is held.
+    If both are held, the one pressed most recently wins.
+    """
+    def __init__(self, keyboard, up, down, serve, stretch):
+        self.keyboard = keyboard
+        self.up = up
+        self.down = down
+        self.serve = serve
+        self.stretch = stretch
+
+    def __call__(self, game, paddle):
+        keyboard = self.keyboard
+        keyboard.begin_step(game.step_count)
+
+        up_since = keyboard.held_since(self.up)
+        down_since = keyboard.held_since(self.down)
+        vy = 0.0
+        if up_since != None and (down_since == None or up_since > down_since):
+            vy = -config.paddle_speed
+        elif down_since != None:
+            vy = config.paddle_speed
+        return {"vy": vy, "serve": keyboard.was_pressed(self.serve), "stretch": keyboard.was_pressed(self.stretch)}
+
+class HardwareInput:
+    """
+    Controls a paddle with the adc and push switches on the Pi.
+    The movement has already been calibrated and filtered by hardware_input, including for an LDR controller if config.adc_using_p1_ldr is set.
+    """
+    def __init__(self, player_id):
+        self.player_id = player_id
+
+    def __call__(self, game, paddle):
+        if self.player_id == "player1":
+            player_input = hardware_input.get_player1_input()
+        else:
+            player_input = hardware_input.get_player2_input()
+
+        return {"vy": player_input["movement"] * config.paddle_speed,
+                "serve": player_input["serve"] == 1,
+                "stretch": player_input["stretch"] == 1}
+
+# Settings for each AI difficulty level:
+# reaction_steps - how many simulation steps it takes to notice the ball's trajectory has changed
+# error - the most squares its aim can be off by
+# speed - the fraction of config.paddle_speed it moves at
+# serve_delay - how many steps it waits before serving
+ai_difficulties = {
+        "easy":   {"reaction_steps": 20, "error": 4.0, "speed": 0.5, "serve_delay": 32},
+        "medium": {"reaction_steps": 10, "error": 2.5, "speed": 0.75, "serve_delay": 16},
+        "hard":   {"reaction_steps": 4,  "error": 1.5, "speed": 1.0, "serve_delay": 8}
+        }
+
+class AIPlayer:
+    """
+    A computer player. It aims for where the ball will reach its paddle, using the game's predictor.
+    Each decision is O(1): the prediction is a closed-form calculation which is cached until the ball's trajectory changes.
+    The time taken by each decision is checked against config.ai_time_budget and overruns are counted and logged.
+    The budget isn't enforced by cutting a decision short, since that would make the AI's moves depend on how busy the machine is, and seeded matches couldn't be played again exactly.
+    """
+    def __init__(self, difficulty="medium", seed=None):
+        settings = ai_difficulties[difficulty]
+        self.difficulty = difficulty
+        self.reaction_steps = settings["reaction_steps"]
+        self.error = settings["error"]
+        self.speed = settings["speed"] * config.paddle_speed
+        self.serve_delay = settings["serve_delay"]
+
+        self.rng = random.Random(seed)
+
+        # The trajectory the AI is currently reacting to, and when it first saw it
+        self.seen_trajectory = None
+        self.seen_step = 0
+        self.aim_error = 0.0
+        self.target_y = None # y position the middle of the paddle is heading for
+        self.overruns = 0
+
+    def __call__(self, game, paddle):
+        start_time = clock.now()
+
+        ball = game.ball
+        if ball.trajectory != self.seen_trajectory:
+            self.seen_trajectory = ball.trajectory
+            self.seen_step = game.step_count
+            self.aim_error = self.rng.uniform(-self.error, self.error)
+
+        # Only change target once the reaction time has passed
+        if game.step_count - self.seen_step >= self.reaction_steps:
+            self.target_y = self.choose_target(game, paddle)
+
+        vy = 0.0
+        if self.target_y != None:
+            distance = self.target_y - (paddle.y + paddle.height / 2.0)
+            vy = max(-self.speed, min(self.speed, distance))
+
+        serve = game.game_state == "serving" and game.step_count - self.seen_step >= self.serve_delay
+
+        time_taken = clock.now() - start_time
+        if time_taken > config.ai_time_budget:
+            self.overruns += 1
+            logging.info("players: AI decision took %.6fs, over its budget of %ss", time_taken, config.ai_time_budget)
+
+        return {"vy": vy, "serve": serve, "stretch": False}
+
+    def choose_target(self, game, paddle):
+        """
+        Returns the y position the middle of the paddle should head for.
+        If the ball is coming towards the paddle this is where it will arrive, otherwise it's the middle of the screen.
+        """
+        if paddle.moving_towards(game.ball):
+            left_x, right_x, top_y, bottom_y = paddle.hitbox()
+            front_x = right_x if paddle.id == "player1" else left_x
+            prediction = game.predictor.intercept(game.ball, front_x)
+            if prediction != None:
+                y, steps = prediction
+                # The ball bounces off the paddle's top edge, so aim the middle of the paddle half a square below where the ball arrives
+                return y + 0.5 + self.aim_error
+
+        return config.game_height / 2.0
@@ -0,0 +1,59 @@
+# Predicts where and when the ball will reach a given x position, e.g. the front of a paddle.
+# Rather than simulating the ball step by step, the bounces off the top and bottom walls are "unfolded":
+# the ball's path is treated as a straight line through copies of the screen mirrored above and below it, and the result is folded back onto the screen.
+# This makes a prediction O(1) no matter how far away the ball is.
+import config
+
+def fold(y, y_max):
+    """
+    Folds an unfolded y position back onto the screen, between 0 and y_max.
+    The mirrored copies of the screen repeat every 2 * y_max.
+    """
+    y = y % (2.0 * y_max)
+    if y > y_max:
+        y = 2.0 * y_max - y
+    return y
+
+def predict_y(x, y, vx, vy, target_x, y_max):
+    """
+    Returns the y position a ball at (x, y) with velocity (vx, vy) will have when it reaches target_x, bouncing off walls at 0 and y_max.
+    Returns None if the ball isn't moving towards target_x.
+    """
+    if vx == 0 or (target_x - x) * vx < 0:
+        return None
+    steps = (target_x - x) / vx
+    return fold(y + vy * steps, y_max)
+
+class Predictor:
+    """
+    Predicts where the ball will reach a given x position, caching the result until the ball's trajectory changes.
+    Wall bounces don't change the trajectory, since they are part of the prediction. Serves and paddle bounces do,
+    and Ball.trajectory is increased whenever that happens, which tells the predictor its cache is out of date.
+    """
+    def __init__(self, y_max=None):
+        # config.game_height is read here rather than as the default, so changes made to the config after this module is imported are used
+        self.y_max = config.game_height if y_max == None else y_max
+        self.cache = {} # maps (trajectory, target_x) to the predicted y
+        self.cached_trajectory = None
+
+    def intercept(self, ball, target_x):
+        """
+        Returns (y, steps): the y position the ball will have when it reaches target_x, and the number of simulation steps until then.
+        Returns None if the ball isn't moving towards target_x.
+        """
+        if ball.vx == 0 or (target_x - ball.x) * ball.vx < 0:
+            return None
+
+        if ball.trajectory != self.cached_trajectory:
+            self.cache = {}
+            self.cached_trajectory = ball.trajectory
+
+        key = (ball.trajectory, target_x)
+        y = self.cache.get(key)
+        if y == None:
+            y = predict_y(ball.x, ball.y, ball.vx, ball.vy, target_x, self.y_max)
+            self.cache[key] = y
+
+        # The ball's x velocity doesn't change until its trajectory does, so the time left is simple to work out
+        steps = (target_x - ball.x) / float(ball.vx)
+        return y, steps
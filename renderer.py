@@ -0,0 +1,178 @@
+import logging
+
+# Every painted square has a priority. When rendering to a byte budget, high priority squares are always drawn first
+# and low priority squares are left for later frames if the budget runs out.
+PRIORITY_HIGH = 0
+PRIORITY_LOW = 1
+
+class Renderer:
+    """
+    A double-buffered renderer for the game grid.
+
+    The front buffer records what is currently showing on the screen and the back buffer is what the game objects paint during the current frame.
+    Each buffer is a dict mapping an (x, y) cell to its colour. Cells which aren't in a buffer are showing the background colour.
+    A cell of the front buffer can also be None, if what it's showing isn't known.
+    When a frame is finished only the cells which differ between the two buffers need to be sent to the terminal.
+    Each buffer also has a matching dict of cell priorities.
+    """
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.front = {}
+        self.back = {}
+        self.front_priority = {}
+        self.back_priority = {}
+
+    def begin_frame(self):
+        """
+        Starts a new frame with an empty back buffer. Game objects should then paint themselves with paint.
+        """
+        self.back = {}
+        self.back_priority = {}
+
+    def paint(self, x, y, colour="", priority=PRIORITY_HIGH):
+        """
+        Paints a single cell of the back buffer. An empty colour means the background colour.
+        Cells outside the grid are ignored.
+        """
+        x = int(x)
+        y = int(y)
+        if x < 0 or x >= self.width or y < 0 or y >= self.height:
+            return
+
+        if colour == "":
+            self.back.pop((x, y), None)
+            self.back_priority.pop((x, y), None)
+        else:
+            self.back[(x, y)] = colour
+            self.back_priority[(x, y)] = priority
+
+    def invalidate(self):
+        """
+        Should be called whenever the screen has been cleared, so that the front buffer matches the blank screen.
+        """
+        logging.debug("renderer: Front buffer invalidated")
+        self.front = {}
+        self.front_priority = {}
+
+    def mark_unknown(self):
+        """
+        Can be called instead of clearing the screen when what's on it isn't known, e.g. after the terminal is resized.
+        Every cell is treated as showing something, so any cell which isn't painted is erased, at low priority.
+        """
+        logging.debug("renderer: Front buffer marked unknown")
+        self.front = dict(((x, y), None) for y in range(self.height) for x in range(self.width))
+        self.front_priority = dict.fromkeys(self.front, PRIORITY_LOW)
+
+    def dirty_cells(self, by_priority=False):
+        """
+        Returns a list of (priority, y, x, colour) tuples for each cell which differs between the front and back buffers.
+        Cells which need erasing have the colour "" and keep the priority of whatever they are currently showing.
+        The list is sorted top to bottom, left to right. If by_priority is True it is sorted by priority first.
+        """
+        front = self.front
+        back = self.back
+        back_priority = self.back_priority
+        front_priority = self.front_priority
+
+        dirty = []
+        for pos, colour in back.items():
+            if front.get(pos) != colour:
+                dirty.append((back_priority[pos], pos[1], pos[0], colour))
+
+        for pos in front:
+            if pos not in back:
+                dirty.append((front_priority[pos], pos[1], pos[0], ""))
+
+        if by_priority:
+            dirty.sort()
+        else:
+            dirty.sort(key=lambda cell: (cell[1], cell[2]))
+        return dirty
+
+    def mark_drawn(self, x, y, colour, priority):
+        """
+        Records that a single cell has been sent to the terminal. Used instead of swap when only some of the dirty cells were drawn.
+        """
+        if colour == "":
+            self.front.pop((x, y), None)
+            self.front_priority.pop((x, y), None)
+        else:
+            self.front[(x, y)] = colour
+            self.front_priority[(x, y)] = priority
+
+    def swap(self):
+        """
+        Makes the back buffer the new front buffer. Should be called once the dirty cells have been sent to the terminal.
+        """
+        self.front = self.back
+        self.front_priority = self.back_priority
+        self.back = {}
+        self.back_priority = {}
+
+class CursorMover:
+    """
+    Keeps track of where the terminal's cursor is and works out the cheapest way of moving it to the next square to be drawn.
+    The options considered are an absolute move, a relative move (right, down, or a carriage return and line feeds), or simply writing over the squares in between when they are showing the current colour.
+    All the sequences come from a pre-built escapes.EscapeTable, so no calls are made into the terminal library.
+    """
+    def __init__(self, escapes):
+        self.escapes = escapes
+        # None means the position is unknown, in which case an absolute move is always used
+        self.x = None
+        self.y = None
+
+    def forget(self):
+        """
+        Should be called whenever something else has moved the cursor.
+        """
+        self.x = None
+        self.y = None
+
+    def advance(self):
+        """
+        Should be called after a square has been written, which moves the cursor one place to the right.
+        Writing to the last column of the terminal leaves the cursor in an awkward state which differs between terminals, so the position is forgotten.
+        """
+        if self.x != None:
+            self.x += 1
+            if self.x >= self.escapes.terminal_width:
+                self.forget()
+
+    def move_to(self, x, y, can_fill=None):
+        """
+        Returns the bytes which move the cursor to (x, y) using as few bytes as possible, and records the new position.
+        can_fill is an optional function taking (start_x, end_x, y). It should return True if the squares from start_x up to but not including end_x can be overwritten with spaces in the current colour without changing what they show.
+        Note the bytes returned for a fill are the spaces themselves, so the caller must print them before the square being drawn.
+        """
+        e = self.escapes
+        best = e.move[y][x]
+
+        if self.x != None:
+            dx = x - self.x
+            dy = y - self.y
+            candidates = []
+
+            if dy == 0:
+                if dx == 0:
+                    candidates.append(b"")
+                elif dx > 0:
+                    candidates.append(e.move_right[dx])
+                    # Writing the squares in between is only worth checking if it could be shorter
+                    if dx < len(best) and can_fill != None and can_fill(self.x, x, y):
+                        candidates.append(b" " * dx)
+                else:
+                    candidates.append(e.move_left[-dx])
+                    candidates.append(e.next_line[0] + e.move_right[x])
+            elif dy > 0:
+                if dx == 0:
+                    candidates.append(e.move_down[dy])
+                candidates.append(e.next_line[dy] + e.move_right[x])
+
+            for candidate in candidates:
+                if len(candidate) < len(best):
+                    best = candidate
+
+        self.x = x
+        self.y = y
+        return best
@@ -0,0 +1,184 @@
+# Records the players' inputs for every simulation step into a compact binary file, and plays matches back from it.
+# Everything random in a match comes from the game's seeded random number generator (the serve direction in Ball.reset and the bounce in Ball.bounce_off_paddle),
+# so the seed, the settings and the inputs are enough to play the match again exactly.
+# Usage:
+#   python replay.py game.rpl              plays the match back in real time in the terminal
+#   python replay.py game.rpl --headless   plays it back as fast as possible with no output, e.g. under cProfile
+#
+# File format (all little endian):
+#   header:  8 byte magic "PONGRPL1", unsigned short version, unsigned long long seed, unsigned short number of settings,
+#            then a double for each of replay_settings in order
+#   records: one per simulation step, a double for each paddle's vy followed by a byte of flags
+import argparse
+import logging
+import struct
+import time
+import blessed
+import config
+import game
+
+magic = b"PONGRPL1"
+version = 1
+
+# The config.py settings which change how a match plays out. They're saved in the header and put back in place for playback.
+replay_settings = [
+        "game_width",
+        "game_height",
+        "game_sim_rate",
+        "game_score_needed_to_win",
+        "ball_init_speed",
+        "ball_bounce_randomness",
+        "paddle_height",
+        "paddle_offset",
+        "paddle_speed",
+        "paddle_max_stretches",
+        "paddle_stretch_duration"
+        ]
+
+header_struct = struct.Struct("<8sHQH")
+settings_struct = struct.Struct("<" + "d" * len(replay_settings))
+record_struct = struct.Struct("<ddB")
+
+# Bits in the flags byte of each record
+P1_SERVE = 1
+P1_STRETCH = 2
+P2_SERVE = 4
+P2_STRETCH = 8
+
+class Recorder:
+    """
+    Writes a replay file as a match is played. Set it as Game.recorder and the game calls record_step every simulation step.
+    Records are saved up in memory and written every flush_every steps, so recording doesn't add a file write to every frame.
+    close must be called at the end of the match, or the last records will be lost.
+    """
+    def __init__(self, filename, seed, flush_every=256):
+        self.file = open(filename, "wb")
+        self.flush_every = flush_every
+        self.buffer = bytearray()
+        self.steps = 0
+
+        self.file.write(header_struct.pack(magic, version, seed, len(replay_settings)))
+        self.file.write(settings_struct.pack(*[getattr(config, name) for name in replay_settings]))
+
+    def record_step(self, player_inputs):
+        """
+        Records the input dicts returned by each player's input source for one simulation step.
+        """
+        p1_input, p2_input = player_inputs
+        flags = 0
+        if p1_input["serve"]:
+            flags |= P1_SERVE
+        if p1_input["stretch"]:
+            flags |= P1_STRETCH
+        if p2_input["serve"]:
+            flags |= P2_SERVE
+        if p2_input["stretch"]:
+            flags |= P2_STRETCH
+
+        self.buffer += record_struct.pack(p1_input["vy"], p2_input["vy"], flags)
+        self.steps += 1
+        if self.steps % self.flush_every == 0:
+            self.flush()
+
+    def flush(self):
+        self.file.write(bytes(self.buffer))
+        self.file.flush()
+        del self.buffer[:]
+
+    def close(self):
+        if self.file != None:
+            self.flush()
+            self.file.close()
+            self.file = None
+
+class Replay:
+    """
+    A replay file loaded into memory.
+    """
+    def __init__(self, filename):
+        with open(filename, "rb") as f:
+            data = f.read()
+
+        file_magic, file_version, self.seed, settings_count = header_struct.unpack_from(data, 0)
+        if file_magic != magic or file_version != version or settings_count != len(replay_settings):
+            raise ValueError("{0} is not a version {1} replay file".format(filename, version))
+
+        values = settings_struct.unpack_from(data, header_struct.size)
+        # The settings are saved as doubles, so they're converted back to the type used in config.py
+        self.settings = dict((name, type(getattr(config, name))(value)) for name, value in zip(replay_settings, values))
+
+        start = header_struct.size + settings_struct.size
+        # A record cut short by a crash is ignored
+        self.steps = (len(data) - start) // record_struct.size
+        self.records = [record_struct.unpack_from(data, start + i * record_struct.size) for i in range(self.steps)]
+
+    def apply_settings(self):
+        """
+        Puts the settings the match was recorded with into config.py. This must be done before the Game is created.
+        """
+        for name, value in self.settings.items():
+            setattr(config, name, value)
+
+    def input_sources(self):
+        """
+        Returns an input source for each player which gives back the recorded inputs.
+        """
+        return [ReplayInput(self, 0, P1_SERVE, P1_STRETCH), ReplayInput(self, 1, P2_SERVE, P2_STRETCH)]
+
+class ReplayInput:
+    """
+    Gives back one player's recorded inputs, step by step. Once the recording runs out the paddle stays still.
+    """
+    def __init__(self, replay, index, serve_flag, stretch_flag):
+        self.records = replay.records
+        self.index = index
+        self.serve_flag = serve_flag
+        self.stretch_flag = stretch_flag
+
+    def __call__(self, game, paddle):
+        if game.step_count >= len(self.records):
+            return {"vy": 0.0, "serve": False, "stretch": False}
+
+        record = self.records[game.step_count]
+        flags = record[2]
+        return {"vy": record[self.index], "serve": flags & self.serve_flag != 0, "stretch": flags & self.stretch_flag != 0}
+
+def play_headless(replay):
+    """
+    Plays a replay back as fast as possible with no output. Returns the finished Game and the winner, which is None if the recording ended before anyone won.
+    """
+    replay.apply_settings()
+    g = game.Game(None, input_sources=replay.input_sources(), seed=replay.seed)
+    winner = g.play_headless(replay.steps)
+    return g, winner
+
+def play_in_terminal(replay):
+    """
+    Plays a replay back in real time in the terminal.
+    """
+    replay.apply_settings()
+    terminal = blessed.Terminal(force_styling=True)
+    with terminal.fullscreen():
+        with terminal.hidden_cursor():
+            terminal.stream.write(terminal.clear)
+            g = game.Game(terminal, input_sources=replay.input_sources(), seed=replay.seed)
+            g.play()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Play back a match recorded to a replay file.")
+    parser.add_argument("replay", help="the replay file, e.g. game.rpl")
+    parser.add_argument("--headless", action="store_true", help="play back as fast as possible with no output")
+    args = parser.parse_args()
+
+    # Only log warnings and errors, since debug logging every step would slow down playback
+    logging.basicConfig(level=logging.WARNING)
+
+    replay = Replay(args.replay)
+    if args.headless:
+        start_time = time.time()
+        g, winner = play_headless(replay)
+        elapsed = time.time() - start_time
+        print("Played {0} steps in {1:.3f}s ({2:.0f} steps per second)".format(g.stats["steps"], elapsed, g.stats["steps"] / max(elapsed, 1e-9)))
+        print("Score: {0}-{1}, winner: {2}".format(g.paddle1.score, g.paddle2.score, winner or "none (the recording ended first)"))
+    else:
+        play_in_terminal(replay)
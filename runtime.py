@@ -0,0 +1,221 @@
+# An event loop which runs everything the game does while it's being played on the main thread: the frame tick, reading the keyboard and the adc, LED effects and music.
+# Each of these used to have its own background thread (or a new thread every time, for LED effects), which on the Pi's single core cost more in thread switching,
+# GIL contention and polling sleeps than the work itself. Python 2.7 has no asyncio, so the loop is built on select and the monotonic clock instead.
+#
+# Things are run on the loop as:
+#   timers  - call_later, call_at and call_every
+#   tasks   - spawn runs a generator, which yields the number of seconds to wait before carrying on, like time.sleep without blocking the loop
+#   readers - add_reader calls back when a file descriptor has input waiting
+# Calls which block on hardware, like reading the adc over I2C or writing frames down the serial cable, can't run on the loop without stalling it.
+# They are run one at a time on a single executor thread with run_in_executor.
+import Queue
+import collections
+import fcntl
+import heapq
+import logging
+import os
+import select
+import threading
+import clock
+
+class Timer(object):
+    """
+    A call scheduled on the loop. Returned by call_later, call_at and call_every so it can be cancelled.
+    """
+    def __init__(self, when, func, args, interval=None):
+        self.when = when
+        self.func = func
+        self.args = args
+        self.interval = interval # the time between calls for a repeating timer, or None
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+class Task(object):
+    """
+    Runs a generator on the loop. Each value it yields is a number of seconds to wait before it carries on.
+    """
+    def __init__(self, loop, generator):
+        self.loop = loop
+        self.generator = generator
+        self.timer = loop.call_later(0, self.step)
+        self.done = False
+
+    def step(self):
+        try:
+            delay = next(self.generator)
+        except StopIteration:
+            self.done = True
+            return
+        self.timer = self.loop.call_later(delay, self.step)
+
+    def cancel(self):
+        if not self.done:
+            self.done = True
+            self.timer.cancel()
+            # This runs any finally blocks in the generator, e.g. to turn off the music pin
+            self.generator.close()
+
+class Executor(object):
+    """
+    Runs blocking calls one at a time, in the order they were submitted, on a single background thread.
+    The thread is only started when the first call is submitted.
+    """
+    def __init__(self):
+        self.queue = Queue.Queue()
+        self.thread = None
+
+    def submit(self, func, args=(), callback=None):
+        """
+        Queues func(*args) to be run. If callback is given it's called with the result, on the executor thread.
+        If func raises an exception it's logged and callback is called with None, so nothing is left waiting for a result which will never come.
+        """
+        if self.thread == None:
+            self.thread = threading.Thread(target=self.worker)
+            # Setting the thread to a daemon means it will end when the main thread ends
+            self.thread.setDaemon(True)
+            self.thread.start()
+        self.queue.put((func, args, callback))
+
+    def worker(self):
+        while True:
+            func, args, callback = self.queue.get()
+            try:
+                result = func(*args)
+            except Exception:
+                logging.exception("runtime: %r failed on the executor thread", func)
+                result = None
+            if callback != None:
+                callback(result)
+
+class EventLoop(object):
+    """
+    Runs timers, tasks and readers on the thread which calls run, until stop is called.
+    Only call_soon_threadsafe and run_in_executor's callbacks may be used from other threads.
+    Exceptions raised by anything run on the loop are not caught, so they end run and crash the game as they would have done on the main thread.
+    """
+    def __init__(self):
+        self.timers = [] # (time, order, Timer), as a heap
+        self.order = 0 # breaks ties between timers due at the same time, so they run in the order they were scheduled
+        self.readers = {} # file descriptor or object with a fileno method -> callback
+        self.ready = collections.deque() # (func, args) to run on the next pass. deque.append is atomic, so other threads can add to it.
+        self.executor = Executor()
+        self.running = False
+
+        # Writing a byte to this pipe wakes the loop up from select when another thread has added a call
+        # The write end doesn't block, so a thread adding a call never waits on the loop
+        self.wake_read, self.wake_write = os.pipe()
+        fcntl.fcntl(self.wake_write, fcntl.F_SETFL, fcntl.fcntl(self.wake_write, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+    def time(self):
+        return clock.now()
+
+    def call_at(self, when, func, *args):
+        """
+        Calls func(*args) once the loop's time reaches when. Returns a Timer.
+        """
+        timer = Timer(when, func, args)
+        self.schedule(timer)
+        return timer
+
+    def call_later(self, delay, func, *args):
+        """
+        Calls func(*args) after delay seconds. Returns a Timer.
+        """
+        return self.call_at(self.time() + delay, func, *args)
+
+    def call_every(self, interval, func, *args):
+        """
+        Calls func(*args) every interval seconds, starting one interval from now. Returns a Timer.
+        If the loop falls behind, the missed calls are skipped rather than run back to back.
+        """
+        timer = Timer(self.time() + interval, func, args, interval)
+        self.schedule(timer)
+        return timer
+
+    def call_soon_threadsafe(self, func, *args):
+        """
+        Calls func(*args) on the loop as soon as possible. Unlike everything else, this can be called from any thread.
+        """
+        self.ready.append((func, args))
+        try:
+            os.write(self.wake_write, b"x")
+        except OSError:
+            pass # the pipe is full, so the loop will wake up anyway
+
+    def spawn(self, generator):
+        """
+        Starts running a generator as a Task, and returns it.
+        """
+        return Task(self, generator)
+
+    def run_in_executor(self, func, args=(), callback=None):
+        """
+        Runs func(*args) on the executor thread. If callback is given it's called with the result back on the loop, or with None if func raised an exception.
+        """
+        if callback == None:
+            self.executor.submit(func, args)
+        else:
+            self.executor.submit(func, args, lambda result: self.call_soon_threadsafe(callback, result))
+
+    def add_reader(self, fd, callback):
+        """
+        Calls callback() whenever fd has input waiting.
+        """
+        self.readers[fd] = callback
+
+    def remove_reader(self, fd):
+        self.readers.pop(fd, None)
+
+    def schedule(self, timer):
+        heapq.heappush(self.timers, (timer.when, self.order, timer))
+        self.order += 1
+
+    def stop(self):
+        """
+        Makes run return once it has finished what it's currently doing.
+        """
+        self.running = False
+
+    def run(self):
+        self.running = True
+        while self.running:
+            self.run_once()
+
+    def run_once(self):
+        """
+        Waits until a reader has input or the next timer is due, then runs whatever is ready.
+        """
+        if self.ready:
+            timeout = 0
+        elif self.timers:
+            timeout = max(0.0, self.timers[0][0] - self.time())
+        else:
+            timeout = None
+
+        readable, _, _ = select.select([self.wake_read] + list(self.readers.keys()), [], [], timeout)
+        for fd in readable:
+            if fd == self.wake_read:
+                os.read(self.wake_read, 4096)
+            elif fd in self.readers:
+                self.readers[fd]()
+
+        # Calls added while these run wait for the next pass, so a timer or task which keeps rescheduling itself can't starve everything else
+        for i in range(len(self.ready)):
+            func, args = self.ready.popleft()
+            func(*args)
+
+        now = self.time()
+        due = []
+        while self.timers and self.timers[0][0] <= now:
+            due.append(heapq.heappop(self.timers)[2])
+        for timer in due:
+            if timer.cancelled:
+                continue
+            if timer.interval != None:
+                timer.when += timer.interval
+                if timer.when <= now:
+                    timer.when = now + timer.interval
+                self.schedule(timer)
+            timer.func(*timer.args)
@@ -0,0 +1,81 @@
+# Runs matches headless as fast as the CPU allows, with no output and no sleeping.
+# This is useful for tuning settings in config.py such as ball_bounce_randomness and paddle_speed without watching games in real time.
+# Usage: python simulate.py -n 100
+# The players can also be AI players, which makes this a soak test of bot-vs-bot matches, e.g.
+#   python simulate.py -n 100 --player1 hard --player2 easy
+import argparse
+import logging
+import random
+import time
+import config
+import game
+import players
+
+def track_ball(g, paddle):
+    """
+    A simple input source which moves the paddle towards the ball and serves straight away.
+    It only moves at half the paddle speed and a little random error is added, so that it sometimes misses.
+    """
+    speed = config.paddle_speed / 2.0
+    error = random.uniform(-1.0, 1.0)
+    distance = (g.ball.y + error) - (paddle.y + paddle.height / 2.0)
+    vy = max(-speed, min(speed, distance))
+    return {"vy": vy, "serve": True, "stretch": False}
+
+def make_player(kind, seed=None):
+    """
+    Returns an input source for a player given on the command line: "tracker" for track_ball, or an AI difficulty.
+    """
+    if kind == "tracker":
+        return track_ball
+    return players.AIPlayer(kind, seed=seed)
+
+def simulate(matches, max_steps=None, player1="tracker", player2="tracker", seed=None):
+    """
+    Plays the given number of headless matches between the given kinds of player.
+    If seed is given, match i is played with seed + i like in batch.py, so the results are the same every time.
+    Returns a dict of results.
+    """
+    wins = {"player1": 0, "player2": 0, None: 0}
+    ai_overruns = 0
+    start_time = time.time()
+    for i in range(matches):
+        if seed == None:
+            game_seed = player1_seed = player2_seed = None
+        else:
+            # Each match's game and AI players get their own seeds, derived from the match's seed
+            match_seed = seed + i
+            game_seed, player1_seed, player2_seed = match_seed * 3, match_seed * 3 + 1, match_seed * 3 + 2
+        input_sources = [make_player(player1, player1_seed), make_player(player2, player2_seed)]
+        g = game.Game(None, input_sources=input_sources, seed=game_seed)
+        wins[g.play_headless(max_steps)] += 1
+        ai_overruns += sum(getattr(source, "overruns", 0) for source in input_sources)
+    elapsed = time.time() - start_time
+
+    return {
+            "matches": matches,
+            "player1_wins": wins["player1"],
+            "player2_wins": wins["player2"],
+            "unfinished": wins[None],
+            "ai_overruns": ai_overruns,
+            "seconds": elapsed,
+            "matches_per_second": matches / elapsed if elapsed > 0 else float("inf")
+            }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate headless matches of pong as fast as possible.")
+    parser.add_argument("-n", "--matches", type=int, default=100, help="number of matches to play")
+    parser.add_argument("--max-steps", type=int, default=100000, help="give up on a match after this many simulation steps")
+    parser.add_argument("--seed", type=int, default=None, help="seed for the random number generator")
+    player_kinds = ["tracker"] + sorted(players.ai_difficulties.keys())
+    parser.add_argument("--player1", choices=player_kinds, default="tracker", help="kind of player for player1")
+    parser.add_argument("--player2", choices=player_kinds, default="tracker", help="kind of player for player2")
+    args = parser.parse_args()
+
+    # Only log warnings and errors, since debug logging every step would dominate the run time
+    logging.basicConfig(level=logging.WARNING)
+    random.seed(args.seed)
+
+    results = simulate(args.matches, args.max_steps, args.player1, args.player2, args.seed)
+    print("Played {matches} matches in {seconds:.2f}s ({matches_per_second:.1f} matches per second)".format(**results))
+    print("player1 wins: {player1_wins}, player2 wins: {player2_wins}, unfinished: {unfinished}, AI decisions over budget: {ai_overruns}".format(**results))
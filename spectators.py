@@ -0,0 +1,258 @@
+# Streams a live match to read-only spectators over TCP, e.g. with "telnet <pi address> 7778".
+# Each frame is rendered once by the game and the same bytes are sent to every spectator.
+# Usage:
+#   set config.spectator_port and run main.py as usual, or
+#   python spectators.py loadtest --clients 300   play an AI match to a fake terminal with hundreds of local spectators connected, and report redraw times
+import argparse
+import collections
+import errno
+import fcntl
+import logging
+import os
+import select
+import socket
+import threading
+import time
+import config
+
+class Spectator:
+    """
+    A connected spectator and the bytes still to be sent to it.
+    """
+    def __init__(self, sock, address):
+        self.sock = sock
+        self.address = address
+        self.pending = b""
+        self.frame_number = None # the number of the last frame queued for this spectator
+        self.needs_keyframe = True
+
+class SpectatorServer:
+    """
+    Sends the game's frames to any number of spectators from one background thread, using select and non-blocking sockets.
+
+    The game thread only calls publish, which stores the frame and wakes the server thread, so its cost doesn't grow with the number of spectators.
+    Frames only contain the squares which changed, so a spectator must be sent every frame in order, starting from a keyframe which redraws the whole screen.
+    Newcomers start with a keyframe. A spectator whose connection can't keep up stops being sent frames once it has max_pending bytes waiting,
+    and if it falls more than history frames behind it skips ahead to the next keyframe.
+    Keyframes are only built when a spectator needs one, at most once per frame however many spectators are waiting.
+    """
+    def __init__(self, port, history=64, max_pending=65536):
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(("", port))
+        self.listener.listen(128)
+        self.listener.setblocking(False)
+        self.max_pending = max_pending
+
+        # Writing a byte to this pipe wakes the server thread up from select
+        # The write end doesn't block, so publish never waits even if the server thread has fallen behind
+        self.wake_read, self.wake_write = os.pipe()
+        fcntl.fcntl(self.wake_write, fcntl.F_SETFL, fcntl.fcntl(self.wake_write, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+        self.lock = threading.Lock()
+        self.frames = collections.deque(maxlen=history) # (frame number, bytes) of the most recent frames
+        self.frame_number = 0
+        self.keyframe = None # (frame number, bytes)
+        self.keyframe_wanted = False # set by the server thread when a spectator is waiting for a keyframe
+
+        self.spectators = []
+        self.keyframes_sent = 0
+        self.frames_skipped = 0
+
+        self.thread = threading.Thread(target=self.worker)
+        # Setting the thread to a daemon means it will end when the main thread ends
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def publish(self, frame, keyframe=None):
+        """
+        Called by the game with the bytes of each frame. keyframe should be given when keyframe_wanted is set.
+        It should redraw the whole screen as it is after frame, and leave the cursor and colour as the next frame expects.
+        """
+        with self.lock:
+            self.frame_number += 1
+            self.frames.append((self.frame_number, frame))
+            if keyframe != None:
+                self.keyframe = (self.frame_number, keyframe)
+                self.keyframe_wanted = False
+        try:
+            os.write(self.wake_write, b"x")
+        except OSError:
+            pass # the pipe is full, so the server thread will wake up anyway
+
+    def worker(self):
+        while True:
+            self.queue_frames()
+            writers = [s.sock for s in self.spectators if s.pending]
+            readers = [self.listener, self.wake_read] + [s.sock for s in self.spectators]
+            readable, writable, _ = select.select(readers, writers, [], 1.0)
+
+            if self.wake_read in readable:
+                os.read(self.wake_read, 4096)
+            if self.listener in readable:
+                self.accept()
+
+            by_socket = dict((s.sock, s) for s in self.spectators)
+            for sock in readable:
+                if sock in by_socket:
+                    self.read(by_socket[sock])
+            for sock in writable:
+                if sock in by_socket:
+                    self.write(by_socket[sock])
+
+    def accept(self):
+        while True:
+            try:
+                sock, address = self.listener.accept()
+            except socket.error:
+                return
+            sock.setblocking(False)
+            self.spectators.append(Spectator(sock, address))
+            logging.info("spectators: %s connected, %s watching", address, len(self.spectators))
+
+    def read(self, spectator):
+        # Spectators can't control anything, so whatever they send is thrown away. An empty read means they disconnected.
+        try:
+            data = spectator.sock.recv(4096)
+        except socket.error as e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            data = b""
+        if not data:
+            self.disconnect(spectator)
+
+    def write(self, spectator):
+        try:
+            sent = spectator.sock.send(spectator.pending)
+        except socket.error as e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            self.disconnect(spectator)
+            return
+        spectator.pending = spectator.pending[sent:]
+
+    def disconnect(self, spectator):
+        if spectator in self.spectators:
+            self.spectators.remove(spectator)
+            spectator.sock.close()
+            logging.info("spectators: %s disconnected, %s watching", spectator.address, len(self.spectators))
+
+    def queue_frames(self):
+        """
+        Queues whichever frames each spectator needs next.
+        """
+        with self.lock:
+            frames = list(self.frames)
+            keyframe = self.keyframe
+        if not frames:
+            return
+        oldest_number = frames[0][0]
+        newest_number = frames[-1][0]
+
+        wanted = False
+        for spectator in self.spectators:
+            if not spectator.needs_keyframe and spectator.frame_number < oldest_number - 1:
+                # The frames it needs next have been forgotten, so it skips ahead to a keyframe
+                self.frames_skipped += 1
+                spectator.needs_keyframe = True
+
+            if spectator.needs_keyframe:
+                if len(spectator.pending) >= self.max_pending:
+                    continue
+                if keyframe == None or keyframe[0] < oldest_number - 1 or (spectator.frame_number != None and keyframe[0] <= spectator.frame_number):
+                    wanted = True
+                    continue
+                spectator.pending += keyframe[1]
+                spectator.frame_number = keyframe[0]
+                spectator.needs_keyframe = False
+                self.keyframes_sent += 1
+
+            if spectator.frame_number < newest_number and len(spectator.pending) < self.max_pending:
+                start = spectator.frame_number - oldest_number + 1
+                spectator.pending += b"".join(frame for number, frame in frames[start:])
+                spectator.frame_number = newest_number
+
+        if wanted:
+            with self.lock:
+                self.keyframe_wanted = True
+
+def load_test(clients, port, seconds, slow_fraction=0.1):
+    """
+    Plays an AI match to a fake terminal for the given number of seconds, first with no spectators and then with the given number connected.
+    A fraction of the spectators read slowly, to check they skip ahead rather than slowing the game down.
+    Prints how long each redraw took on the game thread, including publishing the frame, for both runs.
+    """
+    import blessed
+    import game
+    import players
+    import telemetry
+
+    class FakeStream:
+        def write(self, data):
+            pass
+
+        def flush(self):
+            pass
+
+    config.output_writer_thread = False
+    terminal = blessed.Terminal(kind="xterm-256color", force_styling=True, stream=FakeStream())
+    game.spectator_server = SpectatorServer(port)
+
+    def play_for(seconds):
+        g = game.Game(terminal, input_sources=[players.AIPlayer("hard"), players.AIPlayer("hard")])
+        g.reset_round()
+        g.draw()
+        redraw_times = telemetry.RollingMetric(window=int(seconds * config.game_fps))
+        frame_time = 1 / float(config.game_fps)
+        end_time = time.time() + seconds
+        while time.time() < end_time:
+            g.handle_input()
+            g.update()
+            if g.game_state == "round_ending":
+                g.reset_round()
+            start_time = time.time()
+            g.redraw()
+            redraw_times.add(time.time() - start_time)
+            time.sleep(frame_time)
+        p50, p95, p99 = [t * 1000 for t in redraw_times.percentiles([50, 95, 99])]
+        print("  redraw ms p50 {0:.3f} p95 {1:.3f} p99 {2:.3f} max {3:.3f}".format(p50, p95, p99, redraw_times.max * 1000))
+
+    def read_forever(socks, slow):
+        while True:
+            readable, _, _ = select.select(socks, [], [], 1.0)
+            for sock in readable:
+                try:
+                    sock.recv(65536)
+                except socket.error:
+                    pass
+            if slow:
+                time.sleep(0.5)
+
+    print("No spectators:")
+    play_for(seconds)
+
+    socks = [socket.create_connection(("localhost", port)) for i in range(clients)]
+    slow_count = int(clients * slow_fraction)
+    for group, slow in [(socks[:slow_count], True), (socks[slow_count:], False)]:
+        if group:
+            reader = threading.Thread(target=read_forever, args=(group, slow))
+            reader.setDaemon(True)
+            reader.start()
+
+    print("{0} spectators ({1} reading slowly):".format(clients, slow_count))
+    play_for(seconds)
+    server = game.spectator_server
+    print("Spectators connected: {0}, keyframes sent: {1}, times a spectator skipped ahead: {2}".format(
+            len(server.spectators), server.keyframes_sent, server.frames_skipped))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stream matches to spectators over TCP.")
+    subparsers = parser.add_subparsers(dest="command")
+    load_parser = subparsers.add_parser("loadtest", help="check the game doesn't slow down with many spectators")
+    load_parser.add_argument("--clients", type=int, default=300)
+    load_parser.add_argument("--port", type=int, default=config.spectator_port or 7778)
+    load_parser.add_argument("--seconds", type=float, default=10.0, help="how long to play with and without spectators")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    load_test(args.clients, args.port, args.seconds)
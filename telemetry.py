@@ -0,0 +1,133 @@
+# Per-frame instrumentation for Game.play.
+# Each frame records how long input handling, updating and drawing took, how many bytes were written, how long the loop slept and whether the frame missed its deadline.
+# Only the last few hundred frames are kept for each measurement, so memory use is fixed however long the game runs.
+
+# The measurements recorded for every frame, in the order they're shown
+metric_names = ["input", "update", "draw", "work", "sleep", "bytes"]
+
+# Measurements which are times, and so are shown in milliseconds
+time_metric_names = ["input", "update", "draw", "work", "sleep"]
+
+class RollingMetric:
+    """
+    Keeps the last window samples of a measurement in a circular buffer, plus running totals over every sample.
+    Percentiles are worked out over the window when asked for. Sorting a few hundred numbers is cheap enough to do when showing stats, but it isn't done every frame.
+    """
+    def __init__(self, window=256):
+        self.samples = [0.0] * window
+        self.next_index = 0
+        self.window_count = 0 # how many samples in the window are filled in
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.samples[self.next_index] = value
+        self.next_index = (self.next_index + 1) % len(self.samples)
+        if self.window_count < len(self.samples):
+            self.window_count += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentiles(self, ps):
+        """
+        Returns the given percentiles (between 0 and 100) of the samples in the window, using the nearest rank.
+        """
+        if self.window_count == 0:
+            return [0.0 for p in ps]
+        ordered = sorted(self.samples[:self.window_count])
+        last = self.window_count - 1
+        return [ordered[min(last, int(p / 100.0 * self.window_count))] for p in ps]
+
+    def histogram(self, edges):
+        """
+        Counts the samples in the window between each pair of neighbouring edges. A final count is added for samples past the last edge.
+        """
+        counts = [0] * len(edges)
+        for value in self.samples[:self.window_count]:
+            bucket = 0
+            while bucket < len(edges) - 1 and value >= edges[bucket + 1]:
+                bucket += 1
+            counts[bucket] += 1
+        return counts
+
+    def mean(self):
+        if self.count == 0:
+            return 0.0
+        return self.total / self.count
+
+class Telemetry:
+    """
+    Collects measurements for each frame of the game loop.
+    Call begin_frame at the start of a frame, add to record measurements during it, and end_frame once it's over.
+    A measurement can be added to more than once in a frame, e.g. input and update are run once for every simulation step in the frame.
+    """
+    def __init__(self, frame_time, window=256):
+        self.frame_time = frame_time # the deadline for each frame's work, in seconds
+        self.metrics = dict((name, RollingMetric(window)) for name in metric_names)
+        self.current = dict((name, 0.0) for name in metric_names)
+        self.frames = 0
+        self.missed_deadlines = 0
+
+        # The time from each key arriving to the end of the frame which used it, recorded by players.Keyboard when a human plays with the keyboard
+        self.key_latency = RollingMetric(window)
+
+    def begin_frame(self):
+        for name in metric_names:
+            self.current[name] = 0.0
+
+    def add(self, name, value):
+        self.current[name] += value
+
+    def end_frame(self):
+        current = self.current
+        current["work"] = current["input"] + current["update"] + current["draw"]
+        for name in metric_names:
+            self.metrics[name].add(current[name])
+
+        self.frames += 1
+        if current["work"] > self.frame_time:
+            self.missed_deadlines += 1
+
+    def hud_text(self):
+        """
+        Returns a one line summary which fits under the game, for the on-screen HUD.
+        """
+        work = self.metrics["work"].percentiles([50, 95, 99])
+        bytes_p95 = self.metrics["bytes"].percentiles([95])[0]
+        return "frame ms p50 {0:.2f} p95 {1:.2f} p99 {2:.2f} | missed {3} | bytes p95 {4:.0f}".format(
+                work[0] * 1000, work[1] * 1000, work[2] * 1000, self.missed_deadlines, bytes_p95)
+
+    def report(self):
+        """
+        Returns a table of stats for every measurement, for printing when the game exits.
+        Percentiles are over the most recent frames, while the mean and max are over the whole game.
+        """
+        lines = ["{0} frames, {1} missed the {2:.2f}ms deadline".format(self.frames, self.missed_deadlines, self.frame_time * 1000)]
+        lines.append("{0:<10}{1:>10}{2:>10}{3:>10}{4:>10}{5:>10}".format("", "p50", "p95", "p99", "mean", "max"))
+        for name in metric_names:
+            metric = self.metrics[name]
+            values = metric.percentiles([50, 95, 99]) + [metric.mean(), metric.max]
+            if name in time_metric_names:
+                # Show times in milliseconds
+                values = [value * 1000 for value in values]
+                name = name + " ms"
+            lines.append("{0:<10}".format(name) + "".join("{0:>10.2f}".format(value) for value in values))
+        if self.key_latency.count > 0:
+            values = self.key_latency.percentiles([50, 95, 99]) + [self.key_latency.mean(), self.key_latency.max]
+            lines.append("{0:<10}".format("key ms") + "".join("{0:>10.2f}".format(value * 1000) for value in values))
+
+        # A histogram of how much of the deadline each recent frame's work used
+        lines.append("work as a fraction of the deadline:")
+        fractions = [0.0, 0.25, 0.5, 0.75, 1.0]
+        counts = self.metrics["work"].histogram([fraction * self.frame_time for fraction in fractions])
+        most = max(max(counts), 1)
+        for i, count in enumerate(counts):
+            if i < len(fractions) - 1:
+                label = "{0:.0f}-{1:.0f}%".format(fractions[i] * 100, fractions[i + 1] * 100)
+            else:
+                label = ">{0:.0f}%".format(fractions[i] * 100)
+            lines.append("{0:>10} {1:>6} {2}".format(label, count, "#" * int(40 * count / most)))
+        return "\n".join(lines)